@@ -1,12 +1,9 @@
 """insar: Interferometric SAR processing using TileDB."""
 
-import dask.array as da
-import dask_image.ndfilters
+import importlib
+import logging
 
 from insar.enums import SARType, SARDespeckleType, SARFunctionType
-import logging
-from insar.uavsar import *
-from insar.sar import *
 
 
 __version__ = "1.0.0"
@@ -14,8 +11,29 @@ __version__ = "1.0.0"
 
 logger = logging.getLogger(__name__)
 
+# dask, rasterio, tiledb and xarray take seconds to import so the modules
+# using them are loaded on first access rather than with the package,
+# keeping the rio plugins fast to start
+_submodules = ('cache', 'coregistration', 'dataset', 'export', 'sar',
+               'tiles', 'uavsar')
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module(f"{__name__}.{name}")
+
+    # names previously re-exported from the submodules
+    if not name.startswith('_'):
+        for submodule in ('sar', 'uavsar', 'dataset', 'coregistration',
+                          'cache', 'export'):
+            module = importlib.import_module(f"{__name__}.{submodule}")
+            if hasattr(module, name):
+                return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def process(_input, function, bands=(0, 1), config=None, window=5, output=None):
+
+def process(_input, function, bands=None, config=None, window=5, output=None,
+            cache=None):
     """Reads the associated annotation file to a SLC image.
 
     Parameters
@@ -24,17 +42,28 @@ def process(_input, function, bands=(0, 1), config=None, window=5, output=None):
         Path to a TileDB stack.
     function: enum
         InSAR function type to apply.
+    bands: list
+        Band indexes, defaults to bands 0 and 1 for ccd and to all bands
+        for ps.
     window:: int
         Rolling window size
     output: array
         TileDB output array
+    cache: ProductCache
+        If set and output is None the result is looked up in and stored
+        to the cache.
 
     Returns
     ------
     list : list of tiles and jobs completed
     """        
+    from insar.sar import ccd, statistics
+
     if SARFunctionType[function] == SARFunctionType.ccd:
-        return ccd(_input, bands, output, config)
+        return ccd(_input, bands or (0, 1), output, config, cache=cache)
+    elif SARFunctionType[function] == SARFunctionType.ps:
+        return statistics(_input, output, bands, config, window,
+                          cache=cache)
     else:
         logger.exception(f"Unable to select depeckle type {filter}.")
 
@@ -56,6 +85,9 @@ def despeckle(input, filter, config=None, window=5):
     array: filtered array type
     """
     # reference - https://examples.dask.org/applications/image-processing.html
+    import dask.array as da
+    import dask_image.ndfilters
+
     if SARDespeckleType[filter] == SARDespeckleType.median:
         arr = da.from_tiledb(input, storage_options=config)
         return dask_image.ndfilters.median_filter(arr, window)
@@ -92,6 +124,8 @@ def sar_translate(inputs, output, type_, config, tile_x_size,
     bbox : list
             Subset dimensions of input.
     """
+    from insar import uavsar
+
     if SARType[type_] == SARType.uavsar:
         uavsar.stack(inputs, output, config, tile_x_size, tile_y_size, bbox)
     else:
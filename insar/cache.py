@@ -0,0 +1,211 @@
+"""Provenance keyed cache of derived TileDB products."""
+
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import tiledb
+
+from insar import __version__
+from insar.sar import aux_xml_uri
+
+# prefix of the arrays products are computed into
+STAGING = '_staging_'
+
+
+class ProductCache:
+    """Stores derived arrays under a root keyed by their provenance.
+
+    The provenance of a product is its input array and the timestamps of
+    the input fragments, the function and its parameters and the package
+    version. Products are computed into a staging array and moved to
+    <root>/<function>_<key> once complete, with the provenance in their
+    metadata, so a lookup never sees a partial product. Access times are
+    kept in a small file next to each product and updated at most every
+    access_interval seconds. The least recently used products are
+    evicted once the cache holds more than max_entries products or
+    max_bytes.
+
+    Parameters
+    ----------
+    root : string
+        Directory or bucket prefix holding the cached arrays.
+    max_entries : int
+        Maximum number of cached products, unlimited if None.
+    max_bytes : int
+        Maximum total size of the cached products, unlimited if None.
+    config : dict
+        TileDB configuration.
+    access_interval : float
+        Minimum number of seconds between updates of the access time.
+    staging_timeout : float
+        Age in seconds after which abandoned staging arrays are removed.
+    """
+
+    def __init__(self, root, max_entries=None, max_bytes=None, config=None,
+                 access_interval=3600., staging_timeout=86400.):
+        self.root = root.rstrip('/')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.access_interval = access_interval
+        self.staging_timeout = staging_timeout
+        cfg = tiledb.Config(config)
+        self.ctx = tiledb.Ctx(config=cfg)
+        self.vfs = tiledb.VFS(ctx=self.ctx)
+        if not self.vfs.is_dir(self.root):
+            self.vfs.create_dir(self.root)
+
+    def provenance(self, _input, function, **params):
+        """Describes a product of function applied to an input array."""
+        fragments = tiledb.FragmentInfoList(_input, ctx=self.ctx)
+        if '://' not in _input:
+            _input = os.path.abspath(_input)
+        return {
+            'input': _input,
+            'fragments': [list(map(int, t))
+                          for t in fragments.timestamp_range],
+            'function': function,
+            'params': params,
+            'version': __version__,
+        }
+
+    def key(self, provenance):
+        """Hash of a provenance."""
+        text = json.dumps(provenance, sort_keys=True)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def path(self, provenance):
+        """Location of the product for a provenance."""
+        return f"{self.root}/{provenance['function']}_{self.key(provenance)}"
+
+    def staging_path(self, provenance):
+        """Unique location to compute the product of a provenance into."""
+        suffix = uuid.uuid4().hex[:8]
+        return f"{self.root}/{STAGING}{int(time.time())}_{suffix}_" \
+            f"{provenance['function']}_{self.key(provenance)}"
+
+    def get(self, provenance):
+        """Looks up the product of a provenance.
+
+        Returns
+        ------
+        string : path to the cached product or None
+        """
+        uri = self.path(provenance)
+        if tiledb.object_type(uri, ctx=self.ctx) != 'array':
+            return None
+
+        with tiledb.open(uri, 'r', ctx=self.ctx) as arr:
+            key = arr.meta.get('provenance_key')
+            created = arr.meta.get('last_access', 0.)
+        if key != self.key(provenance):
+            return None
+
+        if time.time() - max(created, self.last_access(uri)) > \
+                self.access_interval:
+            self.touch(uri)
+        return uri
+
+    def put(self, uri, provenance):
+        """Registers a product computed into a staging path.
+
+        The product is moved into the cache, if another run stored the
+        same product first the staged copy is discarded.
+
+        Returns
+        ------
+        string : path to the cached product
+        """
+        with tiledb.open(uri, 'w', ctx=self.ctx) as arr:
+            arr.meta['provenance'] = json.dumps(provenance, sort_keys=True)
+            arr.meta['provenance_key'] = self.key(provenance)
+            arr.meta['last_access'] = time.time()
+
+        target = self.path(provenance)
+        if tiledb.object_type(target, ctx=self.ctx) == 'array':
+            self.vfs.remove_dir(uri)
+        else:
+            self.vfs.move_dir(uri, target)
+            # GDAL finds the metadata file by the name of the array
+            staged_aux = f"{target}/{os.path.basename(uri)}.tdb.aux.xml"
+            if self.vfs.is_file(staged_aux):
+                self.vfs.move_file(staged_aux, aux_xml_uri(target))
+        self.evict(keep=target)
+        return target
+
+    def access_uri(self, uri):
+        return uri.rstrip('/') + '.access'
+
+    def last_access(self, uri):
+        """Time of the last recorded access of a product, 0 if none."""
+        access = self.access_uri(uri)
+        if not self.vfs.is_file(access):
+            return 0.
+        with self.vfs.open(access, 'rb') as f:
+            return float(f.read())
+
+    def touch(self, uri):
+        """Records an access of a product."""
+        with self.vfs.open(self.access_uri(uri), 'wb') as f:
+            f.write(str(time.time()).encode('utf-8'))
+
+    def entries(self):
+        """Lists the cached products.
+
+        Abandoned staging arrays older than staging_timeout are removed.
+
+        Returns
+        ------
+        list : path, last access time and size of each product
+        """
+        entries = []
+        for uri in self.vfs.ls(self.root):
+            name = os.path.basename(uri.rstrip('/'))
+            if name.startswith(STAGING):
+                started = int(name[len(STAGING):].split('_')[0])
+                if time.time() - started > self.staging_timeout:
+                    self.vfs.remove_dir(uri)
+                continue
+            if tiledb.object_type(uri, ctx=self.ctx) != 'array':
+                continue
+            with tiledb.open(uri, 'r', ctx=self.ctx) as arr:
+                if 'provenance_key' not in arr.meta:
+                    continue
+                last_access = max(arr.meta['last_access'],
+                                  self.last_access(uri))
+            entries.append((uri, last_access, self.vfs.dir_size(uri)))
+        return entries
+
+    def evict(self, keep=None):
+        """Removes the least recently used products above the limits.
+
+        Parameters
+        ----------
+        keep : string
+            Path to a product that is never evicted.
+
+        Returns
+        ------
+        list : paths to the removed products
+        """
+        if keep is not None:
+            keep = os.path.basename(keep.rstrip('/'))
+        entries = sorted(self.entries(), key=lambda e: e[1])
+        total = sum(e[2] for e in entries)
+        removed = []
+        for uri, _, size in entries:
+            if os.path.basename(uri.rstrip('/')) == keep:
+                continue
+            over_entries = self.max_entries is not None and \
+                len(entries) - len(removed) > self.max_entries
+            over_bytes = self.max_bytes is not None and total > self.max_bytes
+            if not (over_entries or over_bytes):
+                break
+            self.vfs.remove_dir(uri)
+            if self.vfs.is_file(self.access_uri(uri)):
+                self.vfs.remove_file(self.access_uri(uri))
+            removed.append(uri)
+            total = total - size
+        return removed
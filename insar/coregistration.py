@@ -0,0 +1,304 @@
+"""Sub-pixel co-registration of the bands of a TileDB stack."""
+
+import json
+
+import numpy as np
+import tiledb
+
+import insar.sar as sar
+
+
+def chip_offsets(ref_chips, sec_chips):
+    """Estimates the shift of a batch of chips by phase correlation.
+
+    Parameters
+    ----------
+    ref_chips : array
+        Reference amplitude chips, shape (n, size, size).
+    sec_chips : array
+        Secondary amplitude chips, shape (n, size, size).
+
+    Returns
+    ------
+    tuple : row and column offsets of the secondary chips, such that
+    ref(p) = sec(p + offset), and the correlation peak of each chip
+    """
+    n, size, _ = ref_chips.shape
+    ref_chips = ref_chips - ref_chips.mean(axis=(1, 2), keepdims=True)
+    sec_chips = sec_chips - sec_chips.mean(axis=(1, 2), keepdims=True)
+
+    cross = np.fft.fft2(ref_chips) * np.conjugate(np.fft.fft2(sec_chips))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cross = np.nan_to_num(cross / np.abs(cross))
+    corr = np.abs(np.fft.ifft2(cross))
+
+    peak = corr.reshape(n, -1).argmax(axis=1)
+    py, px = np.unravel_index(peak, (size, size))
+    chips = np.arange(n)
+
+    # parabolic sub-pixel refinement along each axis
+    def refine(c_prev, c_peak, c_next):
+        denom = c_prev - 2 * c_peak + c_next
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.where(denom != 0, (c_prev - c_next) / (2 * denom), 0)
+        return np.clip(delta, -0.5, 0.5)
+
+    c_peak = corr[chips, py, px]
+    dy = py + refine(corr[chips, (py - 1) % size, px], c_peak,
+                     corr[chips, (py + 1) % size, px])
+    dx = px + refine(corr[chips, py, (px - 1) % size], c_peak,
+                     corr[chips, py, (px + 1) % size])
+
+    # the correlation peaks at minus the offset, wrapped to [-size/2, size/2)
+    dy = -(((dy + size / 2) % size) - size / 2)
+    dx = -(((dx + size / 2) % size) - size / 2)
+    return dy, dx, c_peak
+
+
+def estimate_offsets(_input, reference, band, chip_size=64, batch_size=256,
+                     config=None):
+    """Estimates offsets of a band against the reference band.
+
+    One chip is taken from the centre of each tile and the chips are
+    correlated in batches.
+
+    Returns
+    ------
+    array : rows of chip centre y, x, offset dy, dx and correlation peak
+    """
+    cfg = tiledb.Config(config)
+    ctx = tiledb.Ctx(config=cfg)
+    with tiledb.DenseArray(_input, 'r', ctx=ctx) as arr:
+        y_dim = arr.schema.domain.dim(1)
+        x_dim = arr.schema.domain.dim(2)
+        tile_y_size = int(y_dim.tile)
+        tile_x_size = int(x_dim.tile)
+        if chip_size > min(tile_y_size, tile_x_size):
+            raise ValueError('Chip size must not exceed the tile size')
+
+        centres = [(y * tile_y_size + tile_y_size // 2,
+                    x * tile_x_size + tile_x_size // 2)
+                   for y in range(y_dim.size // tile_y_size)
+                   for x in range(x_dim.size // tile_x_size)]
+
+        offsets = []
+        query = arr.query(attrs=['TDB_VALUES'])
+        for i in range(0, len(centres), batch_size):
+            batch = centres[i:i + batch_size]
+            ref_chips = np.empty((len(batch), chip_size, chip_size))
+            sec_chips = np.empty((len(batch), chip_size, chip_size))
+            for k, (cy, cx) in enumerate(batch):
+                y0 = cy - chip_size // 2
+                x0 = cx - chip_size // 2
+                ys = slice(y0, y0 + chip_size)
+                xs = slice(x0, x0 + chip_size)
+                ref_chips[k] = np.abs(query[reference, ys, xs]['TDB_VALUES'])
+                sec_chips[k] = np.abs(query[band, ys, xs]['TDB_VALUES'])
+
+            dy, dx, peak = chip_offsets(ref_chips, sec_chips)
+            offsets.append(np.column_stack([np.array(batch), dy, dx, peak]))
+
+    return np.concatenate(offsets)
+
+
+def warp_terms(y, x, order):
+    """Polynomial terms of the warp, constant for order 0, affine for 1."""
+    terms = [np.ones_like(y)]
+    for n in range(1, order + 1):
+        for k in range(n + 1):
+            terms.append(y ** (n - k) * x ** k)
+    return np.stack(terms, axis=-1)
+
+
+def fit_warp(offsets, order=1):
+    """Fits polynomial warps to the chip offsets weighted by correlation.
+
+    Returns
+    ------
+    dict : coefficients of the row (dy) and column (dx) warps
+    """
+    y, x, dy, dx, peak = offsets.T
+    terms = warp_terms(y, x, order)
+    if terms.shape[1] > len(offsets):
+        raise ValueError(f'Too few tiles to fit a warp of order {order}')
+
+    w = np.sqrt(peak)[:, None]
+    coeffs = {}
+    for name, values in (('dy', dy), ('dx', dx)):
+        coeffs[name] = np.linalg.lstsq(terms * w, values * w[:, 0],
+                                       rcond=None)[0].tolist()
+    return coeffs
+
+
+def sinc_interpolate(data, y, x, taps=8):
+    """Truncated sinc interpolation of data at fractional rows and columns.
+
+    The kernel is a Hann windowed sinc of taps samples along each axis,
+    normalised to unit sum. Unlike bilinear interpolation it keeps the
+    phase of band limited complex data, so resampling a secondary band
+    does not lower its coherence with the reference. Positions outside of
+    data are zero.
+    """
+    h, w = data.shape
+    half = taps // 2
+    y0 = np.floor(y).astype(np.int64)
+    x0 = np.floor(x).astype(np.int64)
+
+    def weights(frac):
+        # distance of each position to the taps y0 - half + 1 ... y0 + half
+        t = frac[..., None] - np.arange(1 - half, half + 1)
+        kernel = np.sinc(t) * (0.5 + 0.5 * np.cos(np.pi * t / half))
+        return kernel / kernel.sum(axis=-1, keepdims=True)
+
+    wy = weights(y - y0)
+    wx = weights(x - x0)
+
+    padded = np.zeros((h + 2 * half, w + 2 * half), dtype=data.dtype)
+    padded[half:-half, half:-half] = data
+    y0 = np.clip(y0, -1, h - 1) + 1
+    x0 = np.clip(x0, -1, w - 1) + 1
+    inside = (y >= -1) & (y < h) & (x >= -1) & (x < w)
+
+    out = np.zeros(y.shape, dtype=np.result_type(data.dtype, np.float64))
+    for i in range(taps):
+        row = np.zeros_like(out)
+        for j in range(taps):
+            row = row + wx[..., j] * padded[y0 + i, x0 + j]
+        out = out + wy[..., i] * row
+    return np.where(inside, out, 0).astype(data.dtype)
+
+
+def calculate_coregistration(_input, output, warps, order, x, y,
+                             tile_x_size, tile_y_size, config=None, taps=8):
+    # bands without a warp, i.e. the reference, are copied as they are
+    cfg = tiledb.Config(config)
+    ctx = tiledb.Ctx(config=cfg)
+    start_y = y * tile_y_size
+    end_y = start_y + tile_y_size
+    start_x = x * tile_x_size
+    end_x = start_x + tile_x_size
+
+    yy, xx = np.mgrid[start_y:end_y, start_x:end_x].astype(np.float64)
+    terms = warp_terms(yy, xx, order)
+
+    with tiledb.DenseArray(_input, 'r', ctx=ctx) as arr:
+        height = arr.schema.domain.dim(1).size
+        width = arr.schema.domain.dim(2).size
+        query = arr.query(attrs=['TDB_VALUES'])
+        tiles = np.zeros((arr.schema.domain.dim(0).size,) + yy.shape,
+                         dtype=arr.schema.attr(0).dtype)
+        for b in range(tiles.shape[0]):
+            if str(b) not in warps:
+                tiles[b] = query[b, start_y:end_y, start_x:end_x]['TDB_VALUES']  # noqa
+                continue
+
+            src_y = yy + terms @ np.array(warps[str(b)]['dy'])
+            src_x = xx + terms @ np.array(warps[str(b)]['dx'])
+
+            # read the part of the secondary band the tile maps from,
+            # with a margin for the interpolation kernel
+            y0 = int(max(np.floor(src_y.min()) - taps // 2, 0))
+            y1 = int(min(np.ceil(src_y.max()) + taps // 2 + 1, height))
+            x0 = int(max(np.floor(src_x.min()) - taps // 2, 0))
+            x1 = int(min(np.ceil(src_x.max()) + taps // 2 + 1, width))
+            if y0 < y1 and x0 < x1:
+                region = query[b, y0:y1, x0:x1]['TDB_VALUES']
+                tiles[b] = sinc_interpolate(region, src_y - y0, src_x - x0,
+                                            taps)
+
+    # all bands of a tile in a single fragment
+    with tiledb.DenseArray(output, 'w', ctx=ctx) as arr_output:
+        arr_output[:, start_y:end_y, start_x:end_x] = tiles
+    return True
+
+
+def coregister(_input, output, reference=0, chip_size=64, order=1,
+               config=None):
+    """Co-registers the bands of a stack to a reference band.
+
+    Offsets are estimated per tile by FFT phase correlation, a polynomial
+    warp is fitted per band and the secondary bands are resampled into
+    the output stack with a truncated sinc kernel. The offsets and warps
+    are stored in the input array metadata and reused on reruns with the
+    same parameters until the input has new fragments.
+
+    Parameters
+    ----------
+    _input : string
+        Path to a TileDB stack.
+    output : string
+        Path to the co-registered TileDB stack.
+    reference : int
+        Index of the reference band.
+    chip_size : int
+        Size of the correlation chip taken from each tile.
+    order : int
+        Order of the polynomial warp.
+    config : dict
+        TileDB configuration.
+
+    Returns
+    ------
+    dict : offsets and warp coefficients of each secondary band
+    """
+    cfg = tiledb.Config(config)
+    ctx = tiledb.Ctx(config=cfg)
+    with tiledb.DenseArray(_input, 'r', ctx=ctx) as arr:
+        schema = arr.schema
+        meta = {k: arr.meta[k] for k in arr.meta.keys()}
+    n_bands = schema.domain.dim(0).size
+    height = schema.domain.dim(1).size
+    width = schema.domain.dim(2).size
+    tile_y_size = int(schema.domain.dim(1).tile)
+    tile_x_size = int(schema.domain.dim(2).tile)
+
+    # the offsets are stale once the input has new fragments
+    fragments = tiledb.FragmentInfoList(_input, ctx=ctx)
+    params = {'reference': reference, 'chip_size': chip_size,
+              'order': order,
+              'fragments': [list(map(int, t))
+                            for t in fragments.timestamp_range]}
+    registration = json.loads(meta.get('coregistration', '{}'))
+    if registration.get('params') != params:
+        bands = [b for b in range(n_bands) if b != reference]
+        f = [sar.client.submit(estimate_offsets, _input, reference, b,
+                               chip_size, config=config) for b in bands]
+        registration = {'params': params, 'offsets': {}, 'warps': {}}
+        for b, offsets in zip(bands, sar.client.gather(f)):
+            registration['offsets'][str(b)] = offsets.tolist()
+            registration['warps'][str(b)] = fit_warp(offsets, order)
+
+        with tiledb.DenseArray(_input, 'w', ctx=ctx) as arr:
+            arr.meta['coregistration'] = json.dumps(registration)
+
+    tiledb.DenseArray.create(output, schema)
+
+    f = []
+
+    for y in range(height // tile_y_size):
+        for x in range(width // tile_x_size):
+            f.append(sar.client.submit(
+                                calculate_coregistration,
+                                _input, output,
+                                registration['warps'], order, x, y,
+                                tile_x_size, tile_y_size, config))
+    sar.client.gather(f)
+
+    # carry over the band labels and geometry of the input stack, the
+    # geometry layers are stored relative to the stack
+    if 'geometry' in meta:
+        layers = json.loads(meta['geometry'])
+        for layer in layers.values():
+            layer['uri'] = sar.relative_uri(
+                output, sar.resolve_uri(_input, layer['uri']))
+        meta['geometry'] = json.dumps(layers)
+    with tiledb.DenseArray(output, 'w', ctx=ctx) as arr_output:
+        for k in ('sources', 'geometry', 'origin'):
+            if k in meta:
+                arr_output.meta[k] = meta[k]
+        arr_output.meta['coregistration'] = json.dumps(registration)
+
+    vfs = tiledb.VFS(ctx=ctx)
+    if vfs.is_file(sar.aux_xml_uri(_input)):
+        vfs.copy_file(sar.aux_xml_uri(_input), sar.aux_xml_uri(output))
+    return registration
@@ -0,0 +1,151 @@
+"""Lazy xarray access to TileDB SAR stacks and derived arrays."""
+
+import json
+
+import dask.array as da
+import numpy as np
+import tiledb
+import xarray as xr
+
+from insar.sar import (overview_factors, overview_uri, resolve_uri,
+                       select_overview)
+
+
+# TileDB dimension names written by sar.stack
+DIMS = {'BANDS': 'band', 'Y': 'y', 'X': 'x'}
+
+
+def geometry_coord(geometry, shape, origin, config=None):
+    """Lazily up samples a geometry layer to the stack resolution."""
+    arr = da.from_tiledb(geometry['uri'], storage_options=config)
+    fy, fx = geometry['factors']
+    arr = da.repeat(da.repeat(arr, fy, axis=0), fx, axis=1)
+
+    # crop to the stack subset and pad to the tile aligned stack domain
+    y0, x0 = origin
+    arr = arr[y0:y0 + shape[0], x0:x0 + shape[1]]
+    pad = [(0, shape[0] - arr.shape[0]), (0, shape[1] - arr.shape[1])]
+    return da.pad(arr, pad, mode='constant', constant_values=np.nan)
+
+
+def open_stack(_input, config=None, geometry=True, level=None, size=None):
+    """Opens a TileDB stack or derived array as a lazy xarray Dataset.
+
+    Each attribute is a data variable backed by dask with chunks aligned
+    to the TileDB tiles. Stacks are labelled with the acquisition of each
+    band and, when ingested, lat/lon coordinates. An overview built by
+    sar.overviews is opened instead of the full resolution array when a
+    level or size is given.
+
+    Parameters
+    ----------
+    _input : string
+        Path to a TileDB array.
+    config : dict
+        TileDB configuration.
+    geometry : bool
+        Add lat/lon coordinates from the ingested geometry layers.
+    level : int
+        Decimation factor of the overview to open.
+    size : tuple
+        Width and height needed, opens the coarsest overview covering it.
+
+    Returns
+    ------
+    Dataset : lazy dataset of the array
+    """
+    cfg = tiledb.Config(config)
+    ctx = tiledb.Ctx(config=cfg)
+    with tiledb.open(_input, 'r', ctx=ctx) as arr:
+        meta = {k: arr.meta[k] for k in arr.meta.keys()}
+
+    uri, factor = _input, 1
+    if size is not None:
+        uri, factor = select_overview(_input, size[0], size[1], config)
+    elif level is not None:
+        if level not in overview_factors(_input, config):
+            raise ValueError(f'{_input} has no overview with factor {level}')
+        uri, factor = overview_uri(_input, level), level
+
+    with tiledb.open(uri, 'r', ctx=ctx) as arr:
+        schema = arr.schema
+
+    dims = [schema.domain.dim(i) for i in range(schema.ndim)]
+    names = [DIMS.get(d.name) for d in dims]
+    if None in names:
+        names = ['band', 'y', 'x'][-len(dims):]
+    shape = tuple(d.size for d in dims)
+
+    coords = {name: np.arange(n) for name, n in zip(names, shape)}
+    if 'band' in coords:
+        coords['band_index'] = ('band', coords['band'])
+        sources = json.loads(meta.get('sources', '[]'))
+        if len(sources) == shape[0]:
+            coords['band'] = sources
+
+    if geometry and 'geometry' in meta:
+        layers = json.loads(meta['geometry'])
+        origin = json.loads(meta.get('origin', '[0, 0]'))
+        full_shape = (shape[-2] * factor, shape[-1] * factor)
+        for name in ('lat', 'lon'):
+            if name in layers:
+                layer = dict(layers[name])
+                layer['uri'] = resolve_uri(_input, layer['uri'])
+                coord = geometry_coord(layer, full_shape, origin, config)
+                coords[name] = (('y', 'x'), coord[::factor, ::factor])
+
+    data_vars = {}
+    for i in range(schema.nattr):
+        attr = schema.attr(i).name
+        data_vars[attr] = (names, da.from_tiledb(
+            uri, attribute=attr, storage_options=config))
+
+    return xr.Dataset(data_vars, coords=coords,
+                      attrs={'uri': uri, 'factor': factor})
+
+
+@xr.register_dataset_accessor('sar')
+class SARAccessor:
+    """Pushes selections on a dataset from open_stack down to TileDB."""
+
+    def __init__(self, xarray_obj):
+        self._obj = xarray_obj
+
+    @property
+    def uri(self):
+        return self._obj.attrs['uri']
+
+    def load(self, config=None):
+        """Reads the current selection with a single TileDB subarray query.
+
+        Only the bounding box of the selected bands and pixels is read
+        rather than every tile the selection touches.
+
+        Returns
+        ------
+        Dataset : selection loaded into memory
+        """
+        ds = self._obj
+        cfg = tiledb.Config(config)
+        ctx = tiledb.Ctx(config=cfg)
+        with tiledb.open(self.uri, 'r', ctx=ctx) as arr:
+            ndim = arr.schema.ndim
+            names = ['band', 'y', 'x'][-ndim:]
+            index = [np.atleast_1d(
+                ds['band_index' if name == 'band' else name].values)
+                for name in names]
+            subarray = tuple(slice(int(i.min()), int(i.max()) + 1)
+                             for i in index)
+            data = arr.query(attrs=list(ds.data_vars))[subarray]
+
+        offsets = np.ix_(*[i - i.min() for i in index])
+        squeeze = tuple(k for k, name in enumerate(names)
+                        if name not in ds.dims)
+
+        data_vars = {}
+        for attr in ds.data_vars:
+            values = data[attr][offsets]
+            data_vars[attr] = (ds[attr].dims, values.squeeze(axis=squeeze))
+
+        return xr.Dataset(data_vars, coords=ds.coords,
+                          attrs=ds.attrs).compute()
@@ -12,3 +12,4 @@ class SARDespeckleType(IntEnum):
 
 class SARFunctionType(IntEnum):
     ccd = 0
+    ps = 1
@@ -0,0 +1,152 @@
+"""Streaming export of TileDB SAR products to Cloud-Optimized GeoTIFF."""
+
+import math
+import os
+import tempfile
+
+import numpy as np
+import tiledb
+
+import insar.sar as sar
+from insar.tiles import TileReader
+
+
+def export(_input, output, band=0, attr=None, level=None, config=None,
+           compress='DEFLATE', blocksize=512, overviews='AUTO',
+           prefetch=4, num_threads='ALL_CPUS', tmp_dir=None):
+    """Exports a band of a TileDB array to a Cloud-Optimized GeoTIFF.
+
+    The array is read tile by tile, with the next tiles prefetched, into
+    a ZSTD compressed tiled GeoTIFF next to the output. Its overviews are
+    built internally and GDAL then copies the blocks and the existing
+    overviews to the COG, compressing on num_threads threads. Memory use
+    is bounded by a few tiles and the GDAL block cache. The geotransform,
+    CRS and image size are taken from the GDAL metadata file of the array
+    when it has one.
+
+    Parameters
+    ----------
+    _input : string
+        Path to a TileDB stack, CCD output or other derived array.
+    output : string
+        Path to the output COG.
+    band : int
+        Band of a stack to export, ignored for 2D arrays.
+    attr : string
+        Attribute to export, defaults to the first attribute.
+    level : int
+        Export the overview decimated by this factor instead, one of the
+        factors registered by sar.overviews.
+    config : dict
+        TileDB configuration.
+    compress : string
+        COG compression method.
+    blocksize : int
+        COG block size.
+    overviews : string
+        COG overview generation, AUTO or NONE.
+    prefetch : int
+        Number of tiles read ahead.
+    num_threads : string
+        Threads used by GDAL for compression.
+    tmp_dir : string
+        Directory for the intermediate GeoTIFF, defaults to the directory
+        of the output or the system temporary directory if the output is
+        not a local file.
+
+    Returns
+    ------
+    string : path to the COG
+    """
+    import rasterio
+    from rasterio.crs import CRS
+    from rasterio.enums import Resampling
+    import rasterio.shutil
+    from rasterio.transform import Affine
+    from rasterio.windows import Window
+
+    if level is not None:
+        if level not in sar.overview_factors(_input, config):
+            raise ValueError(f'{_input} has no overview with factor {level}')
+        _input = sar.overview_uri(_input, level)
+
+    cfg = tiledb.Config(config)
+    ctx = tiledb.Ctx(config=cfg)
+    with tiledb.DenseArray(_input, 'r', ctx=ctx) as arr:
+        schema = arr.schema
+    attr = attr if attr is not None else schema.attr(0).name
+    dims = [schema.domain.dim(i) for i in range(schema.ndim)]
+    height = dims[-2].size
+    width = dims[-1].size
+
+    # a fast compression keeps the intermediate small and cheap to write
+    profile = {
+        'driver': 'GTiff',
+        'count': 1,
+        'dtype': schema.attr(attr).dtype.name,
+        'tiled': True,
+        'blockxsize': blocksize,
+        'blockysize': blocksize,
+        'compress': 'ZSTD',
+        'zstd_level': 1,
+        'num_threads': num_threads,
+        'bigtiff': 'IF_SAFER',
+    }
+
+    # the array domain is padded to whole tiles, GDAL knows the image size
+    aux = sar.read_aux_xml(_input, config)
+    if aux is not None:
+        if aux['transform'] is not None:
+            profile['transform'] = Affine.from_gdal(*aux['transform'])
+        if aux['crs'] is not None:
+            profile['crs'] = CRS.from_wkt(aux['crs'])
+        height = min(height, aux['height'] or height)
+        width = min(width, aux['width'] or width)
+    profile['height'] = height
+    profile['width'] = width
+
+    # skip the tiles of the padding
+    tile_y_size = int(dims[-2].tile)
+    tile_x_size = int(dims[-1].tile)
+    tiles = [(y, x) for y in range(math.ceil(height / tile_y_size))
+             for x in range(math.ceil(width / tile_x_size))]
+    reader = TileReader(_input, tiles,
+                        bands=[band] if schema.ndim == 3 else None,
+                        attr=attr, prefetch=prefetch, config=config)
+
+    # GDAL does not resample complex data with its default cubic
+    resampling = Resampling.cubic
+    if np.issubdtype(np.dtype(profile['dtype']), np.complexfloating):
+        resampling = Resampling.average
+
+    # halve the image until it fits in a block, as the COG driver does
+    factors = []
+    if overviews != 'NONE':
+        factor = 1
+        while max(width, height) / factor > blocksize:
+            factor = factor * 2
+            factors.append(factor)
+
+    if tmp_dir is None and os.path.isdir(
+            os.path.dirname(os.path.abspath(output))):
+        tmp_dir = os.path.dirname(os.path.abspath(output))
+
+    with tempfile.TemporaryDirectory(prefix='insar_', dir=tmp_dir) as tmp:
+        tmp_tif = os.path.join(tmp, 'export.tif')
+        with rasterio.open(tmp_tif, 'w', **profile) as dst:
+            for (y, x), tile in reader:
+                ys, xs = reader.window(y, x)
+                tile = np.reshape(tile, tile.shape[-2:])
+                tile = tile[:height - ys.start, :width - xs.start]
+                dst.write(tile, 1, window=Window(xs.start, ys.start,
+                                                 tile.shape[1],
+                                                 tile.shape[0]))
+            if len(factors) > 0:
+                dst.build_overviews(factors, resampling)
+
+        # the COG driver reuses the overviews of the intermediate
+        rasterio.shutil.copy(tmp_tif, output, driver='COG',
+                             compress=compress, blocksize=blocksize,
+                             overviews=overviews, num_threads=num_threads,
+                             overview_resampling=resampling.name.upper())
+    return output
@@ -1,26 +1,25 @@
 """Generic algorithms for sar processing."""
 
+import json
 import math
 import random
 import os
 import string
 
-import dask.array as da
-from dask.distributed import Client
 import numpy as np
-import rasterio
-from rasterio.dtypes import _gdal_typename
-from rasterio.transform import Affine
 import tiledb
-import xarray as xr
 import xml.etree.ElementTree as ET
 
+from insar.tiles import TileReader, TileWriter
+
 
 client = None
 
 
 def setup(n_workers=1, threads_per_worker=8):
     """ Setup Dask client."""
+    from dask.distributed import Client
+
     global client
     client = Client(
                     n_workers=n_workers,
@@ -49,47 +48,59 @@ def local_ccd(b1, b2):
     return alpha * np.ones(b1.shape, dtype=np.float)
 
 
-def calculate_change(_input, bands, window, x, y, tile_x_size,
-                     tile_y_size, output, config=None):
-    # assuming average reflectivities in the entire two images are ~ equal
-    # https://prod-ng.sandia.gov/techlib-noauth/access-control.cgi/2014/1418179.pdf
-    # noise terms are known and are zero (uavsar, extend as we add additional sensors)
-    cfg = tiledb.Config(config)
-    ctx = tiledb.Ctx(config=cfg)
-    with tiledb.DenseArray(output, 'w', ctx=ctx) as arr_output:
-        with tiledb.DenseArray(_input, 'r', ctx=ctx) as arr:
-            start_y = y * tile_y_size
-            end_y = start_y + tile_y_size
-            start_x = x * tile_x_size
-            end_x = start_x + tile_x_size
+def tile_ccd(t1, t2, window):
+    """Applies local_ccd over non-overlapping windows of a pair of tiles."""
+    out_tile = np.ones(t1.shape, dtype=np.float32)
+    tile_y_size, tile_x_size = t1.shape
 
-            data = arr.query(attrs=['TDB_VALUES'])[:, start_y:end_y, start_x:end_x]  # noqa
-            tile = data["TDB_VALUES"]
-            out_tile = np.ones((tile.shape[1], tile.shape[2]), dtype=np.float32)  # noqa
+    y1 = 0
 
-            y1 = 0
+    while y1 < tile_y_size:
+        x1 = 0
+        y1_end = y1 + window
+        while x1 < tile_x_size:
+            x1_end = x1 + window
+            w1 = t1[y1:y1_end, x1:x1_end]
+            w2 = t2[y1:y1_end, x1:x1_end]
 
-            while y1 < tile_y_size:
-                x1 = 0
-                y1_end = y1 + window
-                while x1 < tile_x_size:
-                    x1_end = x1 + window
-                    t1 = tile[0, y1:y1_end, x1:x1_end]
-                    t2 = tile[1, y1:y1_end, x1:x1_end]
+            out_tile[y1:y1_end, x1:x1_end] = local_ccd(w1, w2)
 
-                    # write result to tiledb output array
-                    out_tile[y1:y1_end, x1:x1_end] = local_ccd(t1, t2)  # noqa
+            x1 = x1 + window
+        y1 = y1 + window
 
-                    x1 = x1 + window
-                y1 = y1 + window
+    return out_tile
 
-            # write out result tile 
-            arr_output[start_y:end_y, start_x:end_x] = out_tile
+
+def calculate_change(_input, bands, window, tiles, output, config=None,
+                     prefetch=2):
+    # assuming average reflectivities in the entire two images are ~ equal
+    # https://prod-ng.sandia.gov/techlib-noauth/access-control.cgi/2014/1418179.pdf
+    # noise terms are known and are zero (uavsar, extend as we add additional sensors)
+    # reads of the next tiles and writes of the previous ones overlap compute
+    reader = TileReader(_input, tiles, bands=bands, attr='TDB_VALUES',
+                        prefetch=prefetch, config=config)
+    with TileWriter(output, queue_size=prefetch, config=config) as writer:
+        for (y, x), tile in reader:
+            out_tile = tile_ccd(tile[0], tile[1], window)
+
+            # write out result tile
+            writer.write(reader.window(y, x), out_tile)
     return True
 
 
-def ccd(_input, bands, output=None, config=None, neighbourhood=7, overlap=1):
+def ccd(_input, bands, output=None, config=None, neighbourhood=7, overlap=1,
+        cache=None):
     if len(bands) == 2:
+        # reuse the result of an earlier run on the same input
+        provenance = None
+        if cache is not None and output is None:
+            provenance = cache.provenance(_input, 'ccd', bands=list(bands),
+                                          neighbourhood=neighbourhood)
+            output = cache.get(provenance)
+            if output is not None:
+                return output
+            output = cache.staging_path(provenance)
+
         if output is None or not os.path.exists(output):
             cfg = tiledb.Config(config)
             ctx = tiledb.Ctx(config=cfg)
@@ -115,37 +126,221 @@ def ccd(_input, bands, output=None, config=None, neighbourhood=7, overlap=1):
 
             tiledb.DenseArray.create(output, schema)
 
+        import dask.array as da
+
         x = da.from_tiledb(_input, storage_options=config)
         _, h, w = x.shape
         _, tile_y_size, tile_x_size = x.chunksize
 
         # w and h are an exact multiple of tile size
         n_tiles_x = w // tile_x_size
-        n_tiles_y = h // tile_x_size
+        n_tiles_y = h // tile_y_size
 
-        # manually chunk and collect
+        # manually chunk and collect, a row of tiles per task
         f = []
 
         for y in range(n_tiles_y):
-            for x in range(n_tiles_x):
-                f.append(client.submit(
-                                    calculate_change,
-                                    _input,
-                                    bands,
-                                    neighbourhood, x, y, tile_x_size,
-                                    tile_y_size, output, config))
+            f.append(client.submit(
+                                calculate_change,
+                                _input,
+                                bands,
+                                neighbourhood,
+                                [(y, x) for x in range(n_tiles_x)],
+                                output, config))
         client.gather(f)
+
+        # the result shares the grid of the input stack
+        aux = read_aux_xml(_input, config)
+        if aux is not None and aux['transform'] is not None:
+            write_aux_xml(output, aux['transform'], np.float32, 32,
+                          aux['width'] or w, aux['height'] or h, config,
+                          crs=aux['crs'])
+
+        if provenance is not None:
+            output = cache.put(output, provenance)
         return output
     else:
         raise IndexError('CCD function requires two band indexes')
 
 
+def calculate_statistics(_input, bands, window, x, y, tile_x_size,
+                         tile_y_size, output, ps_output, threshold,
+                         config=None):
+    # single pass over the stack using Welford accumulators so that only
+    # the current and previous band of a tile are held in memory
+    # amplitude dispersion after Ferretti et al. (2001), D_A = sigma_A / m_A
+    cfg = tiledb.Config(config)
+    ctx = tiledb.Ctx(config=cfg)
+    start_y = y * tile_y_size
+    end_y = start_y + tile_y_size
+    start_x = x * tile_x_size
+    end_x = start_x + tile_x_size
+
+    shape = (tile_y_size, tile_x_size)
+    mean = np.zeros(shape, dtype=np.float64)
+    m2 = np.zeros(shape, dtype=np.float64)
+    coh_max = np.zeros(shape, dtype=np.float32)
+    coh_min = np.ones(shape, dtype=np.float32)
+    prev = None
+
+    with tiledb.DenseArray(_input, 'r', ctx=ctx) as arr:
+        for n, b in enumerate(bands, start=1):
+            data = arr.query(attrs=['TDB_VALUES'])[b, start_y:end_y, start_x:end_x]  # noqa
+            tile = data["TDB_VALUES"]
+            amplitude = np.abs(tile)
+
+            delta = amplitude - mean
+            mean += delta / n
+            m2 += delta * (amplitude - mean)
+
+            if prev is not None:
+                coh = tile_ccd(prev, tile, window)
+                np.maximum(coh_max, coh, out=coh_max)
+                np.minimum(coh_min, coh, out=coh_min)
+            prev = tile
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dispersion = np.sqrt(m2 / (len(bands) - 1)) / mean
+
+    with tiledb.DenseArray(output, 'w', ctx=ctx) as arr_output:
+        arr_output[start_y:end_y, start_x:end_x] = {
+            'mean': mean.astype(np.float32),
+            'dispersion': dispersion.astype(np.float32),
+            'coh_max': coh_max,
+            'coh_min': coh_min}
+
+    # zero amplitude (e.g. padding) gives a nan dispersion and is skipped
+    rows, cols = np.nonzero(dispersion < threshold)
+    if rows.size > 0:
+        with tiledb.SparseArray(ps_output, 'w', ctx=ctx) as arr_ps:
+            arr_ps[rows.astype(np.uint64) + start_y,
+                   cols.astype(np.uint64) + start_x] = {
+                'mean': mean[rows, cols].astype(np.float32),
+                'dispersion': dispersion[rows, cols].astype(np.float32)}
+    return rows.size
+
+
+def statistics(_input, output=None, bands=None, config=None,
+               neighbourhood=7, threshold=0.25, ps_output=None, cache=None):
+    """Multi-temporal statistics and persistent scatterer candidates.
+
+    Parameters
+    ----------
+    _input : string
+        Path to a TileDB stack.
+    output : string
+        Path to the dense statistics array, holds the mean amplitude,
+        amplitude dispersion and the max/min coherence between
+        consecutive bands.
+    bands : list
+        Band indexes to reduce over, defaults to all bands in the stack.
+    config : dict
+        TileDB configuration.
+    neighbourhood : int
+        Window size for the coherence estimate.
+    threshold : float
+        Amplitude dispersion below which a pixel is a PS candidate.
+    ps_output : string
+        Path to the sparse array of PS candidates, defaults to
+        output + '_ps'.
+    cache : ProductCache
+        If set and no outputs are given the results are looked up in and
+        stored to the cache.
+
+    Returns
+    ------
+    tuple : paths to the statistics and PS candidate arrays
+    """
+    cfg = tiledb.Config(config)
+    ctx = tiledb.Ctx(config=cfg)
+    with tiledb.DenseArray(_input, 'r', ctx=ctx) as arr:
+        b_dim = arr.schema.domain.dim(0)
+        y_dim = arr.schema.domain.dim(1)
+        x_dim = arr.schema.domain.dim(2)
+        height = y_dim.size
+        width = x_dim.size
+        tile_y_size = int(y_dim.tile)
+        tile_x_size = int(x_dim.tile)
+
+    if bands is None:
+        bands = list(range(b_dim.size))
+
+    if len(bands) < 2:
+        raise IndexError('Statistics require at least two band indexes')
+
+    # reuse the results of an earlier run on the same input
+    provenance = None
+    if cache is not None and output is None and ps_output is None:
+        provenance = cache.provenance(_input, 'statistics', bands=list(bands),
+                                      neighbourhood=neighbourhood,
+                                      threshold=threshold)
+        ps_provenance = dict(provenance, function='ps')
+        output = cache.get(provenance)
+        ps_output = cache.get(ps_provenance)
+        if output is not None and ps_output is not None:
+            return output, ps_output
+        output = cache.staging_path(provenance)
+        ps_output = cache.staging_path(ps_provenance)
+
+    if output is None:
+        output = _input + '_stats_' + ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(4))  # noqa
+
+    if ps_output is None:
+        ps_output = output + '_ps'
+
+    dom = tiledb.Domain(
+            tiledb.Dim(name='Y', domain=(0, height - 1),
+                       tile=tile_y_size, dtype=np.uint64),
+            tiledb.Dim(name='X', domain=(0, width - 1),
+                       tile=tile_x_size, dtype=np.uint64))
+
+    schema = tiledb.ArraySchema(
+                domain=dom, sparse=False,
+                attrs=[tiledb.Attr(name=name, dtype=np.float32)
+                       for name in ('mean', 'dispersion',
+                                    'coh_max', 'coh_min')], ctx=ctx)
+    tiledb.DenseArray.create(output, schema)
+
+    ps_schema = tiledb.ArraySchema(
+                domain=dom, sparse=True,
+                attrs=[tiledb.Attr(name=name, dtype=np.float32)
+                       for name in ('mean', 'dispersion')], ctx=ctx)
+    tiledb.SparseArray.create(ps_output, ps_schema)
+
+    n_tiles_x = width // tile_x_size
+    n_tiles_y = height // tile_y_size
+
+    f = []
+
+    for y in range(n_tiles_y):
+        for x in range(n_tiles_x):
+            f.append(client.submit(
+                                calculate_statistics,
+                                _input,
+                                bands,
+                                neighbourhood, x, y, tile_x_size,
+                                tile_y_size, output, ps_output,
+                                threshold, config))
+    client.gather(f)
+
+    if provenance is not None:
+        output = cache.put(output, provenance)
+        ps_output = cache.put(ps_output, ps_provenance)
+    return output, ps_output
+
+
 def stack(_input, output, tile_x_size, tile_y_size,
           config=None, attrs=None, bbox=None):
+    import rasterio
+    from rasterio.transform import Affine
+    import xarray as xr
+
     with rasterio.open(_input) as src:
         profile = src.profile
         trans = Affine.to_gdal(src.transform)
         dt = np.dtype(src.dtypes[0])  # read first band data type
+        # acquisition of each band, e.g. the source MDI of a stack VRT
+        sources = [src.tags(i).get('source', str(i - 1)) for i in src.indexes]
 
     # read initial image metadata
     profile['driver'] = 'TileDB'
@@ -185,31 +380,330 @@ def stack(_input, output, tile_x_size, tile_y_size,
 
     tiledb.DenseArray.create(output, schema)
     with tiledb.DenseArray(output, 'w', ctx=ctx) as arr_output:
-        arr[:, bbox[0]:bbox[2], bbox[1]:bbox[3]].data.to_tiledb(
+        arr[:, bbox[1]:bbox[3], bbox[0]:bbox[2]].data.to_tiledb(
             arr_output, storage_options=config)
 
+    # ingest the geometry layers (e.g. lat/lon) as 2D arrays
+    geometry = {}
+    for name, meta in (attrs or {}).items():
+        geometry[name] = stack_geometry(meta, f"{output}_{name}",
+                                        profile['height'], profile['width'],
+                                        tile_x_size, tile_y_size, config)
+        # relative to the stack so that it can be opened from anywhere
+        geometry[name]['uri'] = relative_uri(output, geometry[name]['uri'])
+
+    with tiledb.DenseArray(output, 'w', ctx=ctx) as arr_output:
+        arr_output.meta['sources'] = json.dumps(sources)
+        arr_output.meta['geometry'] = json.dumps(geometry)
+        arr_output.meta['origin'] = json.dumps([bbox[1], bbox[0]])
+
     # write the GDAL metadata file from the source profile
-    vfs = tiledb.VFS()
-    meta = f"{output}/{os.path.basename(output)}.tdb.aux.xml"
-    try:
-        f = vfs.open(meta, "w")
-        root = ET.Element('PAMDataset')
-        geo = ET.SubElement(root, 'GeoTransform')
-        geo.text = ', '.join(map(str, trans))
-        meta = ET.SubElement(root, 'Metadata')
-        meta.set('domain', 'IMAGE_STRUCTURE')
-        t = ET.SubElement(meta, 'MDI')
-        t.set('key', 'DATA_TYPE')
-        t.text = _gdal_typename(np.complex128)
-        nbits = ET.SubElement(meta, 'MDI')
-        nbits.set('key', 'NBITS')
-        nbits.text = str(dt.itemsize * 8)
-        xsize = ET.SubElement(meta, 'MDI')
-        xsize.set('key', 'X_SIZE')
-        xsize.text = str(w)
-        ysize = ET.SubElement(meta, 'MDI')
-        ysize.set('key', 'Y_SIZE')
-        ysize.text = str(h)
-        vfs.write(f, ET.tostring(root))
-    finally:
-        vfs.close(f)
+    crs = profile['crs'].to_wkt() if profile.get('crs') else None
+    write_aux_xml(output, trans, np.complex128, dt.itemsize * 8, w, h,
+                  config, crs=crs)
+
+
+def stack_geometry(_input, output, height, width, tile_x_size,
+                   tile_y_size, config=None):
+    """Ingests a down sampled geometry layer of a stack.
+
+    Parameters
+    ----------
+    _input : string
+        Path to a single band geometry image.
+    output : string
+        Path to output TileDB array.
+    height : int
+        Number of rows of the full resolution image.
+    width : int
+        Number of columns of the full resolution image.
+
+    Returns
+    ------
+    dict : output path and down sampling factors (rows/cols)
+    """
+    import xarray as xr
+
+    arr = xr.open_rasterio(_input,
+                           chunks={'x': tile_x_size, 'y': tile_y_size})
+    _, rows, cols = arr.shape
+    arr[0].data.astype(np.float32).to_tiledb(output, storage_options=config)
+
+    return {'uri': output,
+            'factors': [math.ceil(height / rows), math.ceil(width / cols)]}
+
+
+def resolve_uri(_input, uri):
+    """Resolves a path stored relative to the directory of an array."""
+    if '://' in uri or os.path.isabs(uri):
+        return uri
+    parent = os.path.dirname(_input.rstrip('/'))
+    return f"{parent}/{uri}" if parent else uri
+
+
+def relative_uri(_input, uri):
+    """Path relative to the directory of an array, for local arrays."""
+    if '://' in uri or '://' in _input:
+        return uri
+    parent = os.path.dirname(os.path.abspath(_input.rstrip('/')))
+    return os.path.relpath(os.path.abspath(uri), parent)
+
+
+def aux_xml_uri(_input):
+    """Path to the GDAL PAM metadata file of a TileDB array."""
+    return f"{_input}/{os.path.basename(_input)}.tdb.aux.xml"
+
+
+def write_aux_xml(output, trans, data_type, nbits, width, height,
+                  config=None, crs=None):
+    """Writes the GDAL PAM metadata file read by the GDAL TileDB driver."""
+    from rasterio.dtypes import _gdal_typename
+
+    root = ET.Element('PAMDataset')
+    if crs is not None:
+        srs = ET.SubElement(root, 'SRS')
+        srs.text = crs
+    geo = ET.SubElement(root, 'GeoTransform')
+    geo.text = ', '.join(map(str, trans))
+    meta = ET.SubElement(root, 'Metadata')
+    meta.set('domain', 'IMAGE_STRUCTURE')
+    t = ET.SubElement(meta, 'MDI')
+    t.set('key', 'DATA_TYPE')
+    t.text = _gdal_typename(data_type)
+    nbits_mdi = ET.SubElement(meta, 'MDI')
+    nbits_mdi.set('key', 'NBITS')
+    nbits_mdi.text = str(nbits)
+    xsize = ET.SubElement(meta, 'MDI')
+    xsize.set('key', 'X_SIZE')
+    xsize.text = str(width)
+    ysize = ET.SubElement(meta, 'MDI')
+    ysize.set('key', 'Y_SIZE')
+    ysize.text = str(height)
+
+    cfg = tiledb.Config(config)
+    vfs = tiledb.VFS(ctx=tiledb.Ctx(config=cfg))
+    with vfs.open(aux_xml_uri(output), 'wb') as f:
+        f.write(ET.tostring(root))
+
+
+def read_aux_xml(_input, config=None):
+    """Reads the GDAL PAM metadata file of a TileDB array.
+
+    Returns
+    ------
+    dict : geotransform, CRS as WKT and image size or None if no file was
+    written, missing entries are None
+    """
+    cfg = tiledb.Config(config)
+    vfs = tiledb.VFS(ctx=tiledb.Ctx(config=cfg))
+    meta = aux_xml_uri(_input)
+    if not vfs.is_file(meta):
+        return None
+
+    with vfs.open(meta, 'rb') as f:
+        root = ET.fromstring(f.read())
+
+    aux = {'transform': None, 'crs': None, 'width': None, 'height': None}
+    geo = root.find('GeoTransform')
+    if geo is not None:
+        aux['transform'] = tuple(float(v) for v in geo.text.split(','))
+    srs = root.find('SRS')
+    if srs is not None:
+        aux['crs'] = srs.text
+    for mdi in root.iter('MDI'):
+        if mdi.get('key') == 'X_SIZE':
+            aux['width'] = int(mdi.text)
+        elif mdi.get('key') == 'Y_SIZE':
+            aux['height'] = int(mdi.text)
+    return aux
+
+
+def read_geotransform(_input, config=None):
+    """Reads the GDAL geotransform of a TileDB array if one was written.
+
+    Returns
+    ------
+    tuple : GDAL geotransform or None
+    """
+    aux = read_aux_xml(_input, config)
+    return None if aux is None else aux['transform']
+
+
+def overview_uri(_input, factor):
+    """Path to the overview of a TileDB array decimated by factor."""
+    return f"{_input}_ovr_{factor}"
+
+
+def overview_factors(_input, config=None):
+    """Decimation factors of the overviews registered on a TileDB array."""
+    cfg = tiledb.Config(config)
+    ctx = tiledb.Ctx(config=cfg)
+    with tiledb.open(_input, 'r', ctx=ctx) as arr:
+        if 'overviews' not in arr.meta:
+            return []
+        return [int(v) for v in arr.meta['overviews'].split(',')]
+
+
+def select_overview(_input, width, height, config=None):
+    """Selects the coarsest overview that still covers the requested size.
+
+    Parameters
+    ----------
+    _input : string
+        Path to a TileDB array with overviews.
+    width : int
+        Requested number of columns.
+    height : int
+        Requested number of rows.
+
+    Returns
+    ------
+    tuple : path to the array to read and its decimation factor
+    """
+    cfg = tiledb.Config(config)
+    ctx = tiledb.Ctx(config=cfg)
+    with tiledb.open(_input, 'r', ctx=ctx) as arr:
+        dims = arr.schema.domain
+        full_height = dims.dim(dims.ndim - 2).size
+        full_width = dims.dim(dims.ndim - 1).size
+
+    selected = (_input, 1)
+    for factor in sorted(overview_factors(_input, config)):
+        if full_width // factor < width or full_height // factor < height:
+            break
+        selected = (overview_uri(_input, factor), factor)
+    return selected
+
+
+def block_average(tile):
+    """Decimates the last two axes of a tile by 2x2 block averaging."""
+    h, w = tile.shape[-2:]
+    blocks = tile.reshape(tile.shape[:-2] + (h // 2, 2, w // 2, 2))
+    return blocks.mean(axis=(-3, -1))
+
+
+def calculate_overviews(_input, factors, x, y, tile_x_size, tile_y_size,
+                        config=None):
+    # each level is derived from the previous one so the full resolution
+    # tile is read exactly once
+    cfg = tiledb.Config(config)
+    ctx = tiledb.Ctx(config=cfg)
+    start_y = y * tile_y_size
+    end_y = start_y + tile_y_size
+    start_x = x * tile_x_size
+    end_x = start_x + tile_x_size
+
+    # all bands of a level are written at once, one fragment per tile
+    with tiledb.DenseArray(_input, 'r', ctx=ctx) as arr:
+        attr = arr.schema.attr(0).name
+        subarray = (slice(start_y, end_y), slice(start_x, end_x))
+        if arr.schema.ndim == 3:
+            subarray = (slice(None),) + subarray
+        tile = arr.query(attrs=[attr])[subarray][attr]
+
+    # phase does not average, complex data is reduced to amplitude
+    if np.iscomplexobj(tile):
+        tile = np.abs(tile)
+    level = tile.astype(np.float32)
+
+    scale = 1
+    for factor in factors:
+        while scale < factor:
+            level = block_average(level)
+            scale = scale * 2
+        ys = start_y // factor
+        xs = start_x // factor
+        subarray = (slice(ys, ys + level.shape[-2]),
+                    slice(xs, xs + level.shape[-1]))
+        if level.ndim == 3:
+            subarray = (slice(None),) + subarray
+        with tiledb.DenseArray(overview_uri(_input, factor), 'w',
+                               ctx=ctx) as arr_level:
+            arr_level[subarray] = level
+    return True
+
+
+def overviews(_input, levels=3, config=None):
+    """Builds decimated overviews (2x, 4x, 8x, ...) of a TileDB array.
+
+    Each level is written to its own array next to the input and the
+    factors are registered in the input array metadata, a GDAL metadata
+    file with the scaled geotransform is written for each level when the
+    input has one.
+
+    Parameters
+    ----------
+    _input : string
+        Path to a TileDB stack or CCD output.
+    levels : int
+        Number of overview levels.
+    config : dict
+        TileDB configuration.
+
+    Returns
+    ------
+    list : paths to the overview arrays
+    """
+    if levels < 1:
+        raise ValueError('At least one overview level is required')
+
+    factors = [2 ** (i + 1) for i in range(levels)]
+
+    cfg = tiledb.Config(config)
+    ctx = tiledb.Ctx(config=cfg)
+    with tiledb.DenseArray(_input, 'r', ctx=ctx) as arr:
+        schema = arr.schema
+    dims = [schema.domain.dim(i) for i in range(schema.ndim)]
+    height = dims[-2].size
+    width = dims[-1].size
+    tile_y_size = int(dims[-2].tile)
+    tile_x_size = int(dims[-1].tile)
+
+    if tile_y_size % factors[-1] != 0 or tile_x_size % factors[-1] != 0:
+        raise ValueError(
+            f'Tile size must be a multiple of the overview factor {factors[-1]}')  # noqa
+
+    aux = read_aux_xml(_input, config)
+    trans = None if aux is None else aux['transform']
+    outputs = []
+    for factor in factors:
+        level_dims = [tiledb.Dim(name=d.name, domain=d.domain, tile=d.tile,
+                                 dtype=d.dtype) for d in dims[:-2]]
+        for d, size, tile in [(dims[-2], height, tile_y_size),
+                              (dims[-1], width, tile_x_size)]:
+            level_dims.append(tiledb.Dim(name=d.name,
+                                         domain=(0, size // factor - 1),
+                                         tile=tile // factor,
+                                         dtype=d.dtype))
+        level_schema = tiledb.ArraySchema(
+                domain=tiledb.Domain(*level_dims), sparse=False,
+                attrs=[tiledb.Attr(name=schema.attr(0).name,
+                                   dtype=np.float32)], ctx=ctx)
+        output = overview_uri(_input, factor)
+        tiledb.DenseArray.create(output, level_schema)
+
+        if trans is not None:
+            level_trans = (trans[0], trans[1] * factor, trans[2] * factor,
+                           trans[3], trans[4] * factor, trans[5] * factor)
+            # the level covers the image, not the tile padded domain
+            write_aux_xml(output, level_trans, np.float32, 32,
+                          math.ceil((aux['width'] or width) / factor),
+                          math.ceil((aux['height'] or height) / factor),
+                          config, crs=aux['crs'])
+        outputs.append(output)
+
+    f = []
+
+    for y in range(height // tile_y_size):
+        for x in range(width // tile_x_size):
+            f.append(client.submit(
+                                calculate_overviews,
+                                _input,
+                                factors, x, y, tile_x_size,
+                                tile_y_size, config))
+    client.gather(f)
+
+    # register the levels once they are complete
+    with tiledb.open(_input, 'w', ctx=ctx) as arr:
+        arr.meta['overviews'] = ','.join(map(str, factors))
+    return outputs
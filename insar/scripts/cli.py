@@ -1,12 +1,12 @@
 """insar.scripts.cli."""
 
 import configparser
+import json
 import logging
 import os
 
 
 import click
-import tiledb
 
 import insar
 
@@ -26,6 +26,16 @@ def tiledb_config_handler(ctx, param, value):
         return {}
 
 
+def bands_handler(ctx, param, value):
+    """Parse a comma separated list of band indexes"""
+    if value is None:
+        return None
+    try:
+        return [int(b) for b in value.split(',')]
+    except ValueError:
+        raise click.BadParameter('bands must be comma separated integers')
+
+
 @click.group(short_help="Translate SAR stacks to TileDB arrays.")
 @click.pass_context
 def sar():
@@ -43,9 +53,10 @@ def sar():
 @click.option('--function', '-f', 'function', help="InSAR function type.",
               type=click.Choice(
                   [it.name for it in insar.SARFunctionType
-                   if it.value in [0]]),
+                   if it.value in [0, 1]]),
               default=None, show_default=True)
-@click.option('--bands', nargs=2, type=int, default=(0, 1), help="InSAR bands")
+@click.option('--bands', type=int, nargs=2, default=None, help="InSAR band pair, defaults to 0 1 for ccd and all bands for ps")
+@click.option('--ps_bands', default=None, callback=bands_handler, help="comma separated bands for ps, e.g. 0,2,4")
 @click.option('--window_size', type=int, default=5)
 @click.option('--config', type=click.File('r'), default=None,
               callback=tiledb_config_handler, help="TileDB config.")
@@ -55,7 +66,7 @@ def sar():
 @click.option('--n_workers', type=int, default=1, help="number of dask workers")
 @click.option('--threads_per_worker', type=int, default=4, help="dask threads per worker")
 @click.pass_context
-def stack_sar(ctx, inputs, output, type_, function, bands,
+def stack_sar(ctx, inputs, output, type_, function, bands, ps_bands,
               window_size, config, tile_x_size, tile_y_size, bbox,
               n_workers, threads_per_worker):
     """Create TileDB SAR stack."""
@@ -86,7 +97,7 @@ def stack_sar(ctx, inputs, output, type_, function, bands,
             if function is not None:
                 insar.process(
                               output, function,
-                              bands, config=config
+                              ps_bands or bands, config=config
                              )
 
     except Exception:
@@ -100,15 +111,21 @@ def stack_sar(ctx, inputs, output, type_, function, bands,
 @click.option('--function', '-f', 'function', help="InSAR function type.",
               type=click.Choice(
                   [it.name for it in insar.SARFunctionType
-                   if it.value in [0]]),
+                   if it.value in [0, 1]]),
               default=None, show_default=True)
-@click.option('--bands', nargs=2, type=int, default=(0, 1), help="InSAR bands")
+@click.option('--bands', type=int, nargs=2, default=None, help="InSAR band pair, defaults to 0 1 for ccd and all bands for ps")
+@click.option('--ps_bands', default=None, callback=bands_handler, help="comma separated bands for ps, e.g. 0,2,4")
 @click.option('--config', type=click.File('r'), default=None,
               callback=tiledb_config_handler, help="TileDB config.")
 @click.option('--n_workers', type=int, default=1, help="number of dask workers")
 @click.option('--threads_per_worker', type=int, default=4, help="dask threads per worker")
+@click.option('--cache', 'cache_root', default=None, help="Root of the product cache, used when no output is given.")
+@click.option('--cache_max_entries', type=int, default=None, help="maximum number of cached products")
+@click.option('--cache_max_bytes', type=int, default=None, help="maximum size of the cached products")
 @click.pass_context
-def process_stack(ctx, input_, output, function, bands, config, n_workers, threads_per_worker):
+def process_stack(ctx, input_, output, function, bands, ps_bands, config,
+                  n_workers, threads_per_worker, cache_root,
+                  cache_max_entries, cache_max_bytes):
     """Process TileDB SAR stack."""
     logger = logging.getLogger(__name__)
     try:
@@ -118,20 +135,93 @@ def process_stack(ctx, input_, output, function, bands, config, n_workers, threa
                 logger.exception(f"{input_} does not exist.")
                 raise click.Abort()
 
-            if os.path.exists(output):
+            if output is not None and os.path.exists(output):
                 logger.exception(f"{output} already exists.")
                 raise click.Abort()
 
-            insar.process(
+            cache = None
+            if cache_root is not None:
+                cache = insar.cache.ProductCache(
+                    cache_root, cache_max_entries, cache_max_bytes, config)
+
+            result = insar.process(
                           input_, function,
-                          bands, output=output, config=config
+                          ps_bands or bands, output=output, config=config,
+                          cache=cache
                          )
+            click.echo(result)
+    except Exception:
+        logger.exception("Exception caught during processing")
+        raise click.Abort()
+
+
+@sar.command(short_help="Create InSAR stacks for many flight lines.")
+@click.argument('inputs', nargs=-1, type=click.Path(exists=True))
+@click.option('--output', required=True, help="Output group.")
+@click.option('--config', type=click.File('r'), default=None,
+              callback=tiledb_config_handler, help="TileDB config.")
+@click.option('--tile_x_size', type=int, default=1024)
+@click.option('--tile_y_size', type=int, default=1024)
+@click.option('--bbox', nargs=4, type=int, help="subset box, minx,miny,maxx,maxy")
+@click.option('--max_concurrent', type=int, default=4, help="number of stacks ingested concurrently")
+@click.option('--n_workers', type=int, default=1, help="number of dask workers")
+@click.option('--threads_per_worker', type=int, default=4, help="dask threads per worker")
+@click.pass_context
+def batch_stack(ctx, inputs, output, config, tile_x_size, tile_y_size, bbox,
+                max_concurrent, n_workers, threads_per_worker):
+    """Create a TileDB group of SAR stacks from directories or manifests."""
+    logger = logging.getLogger(__name__)
+    try:
+        insar.sar.setup(n_workers, threads_per_worker)
+        with ctx.obj['env']:
+            if os.path.exists(output):
+                logger.exception(f"{output} already exists.")
+                raise click.Abort()
+
+            summary = insar.uavsar.batch_stack(
+                inputs, output, config, tile_x_size, tile_y_size,
+                bbox or None, max_concurrent)
+    except Exception:
+        logger.exception("Exception caught during processing")
+        raise click.Abort()
+
+    click.echo(json.dumps(summary))
+    if len(summary['failed']) > 0:
+        raise click.Abort()
+
+
+@sar.command(short_help="Export TileDB SAR array to a COG.")
+@click.argument('input_', type=click.Path())
+@click.argument('output', type=click.Path())
+@click.option('--band', type=int, default=0, help="Band of a stack.")
+@click.option('--attr', default=None, help="Attribute to export.")
+@click.option('--level', type=int, default=None, help="Overview decimation factor.")
+@click.option('--compress', default='DEFLATE', help="COG compression.")
+@click.option('--blocksize', type=int, default=512, help="COG block size.")
+@click.option('--config', type=click.File('r'), default=None,
+              callback=tiledb_config_handler, help="TileDB config.")
+@click.pass_context
+def export_sar(ctx, input_, output, band, attr, level, compress, blocksize,
+               config):
+    """Export TileDB SAR array to a Cloud-Optimized GeoTIFF."""
+    logger = logging.getLogger(__name__)
+    try:
+        with ctx.obj['env']:
+            if os.path.exists(output):
+                logger.exception(f"{output} already exists.")
+                raise click.Abort()
+
+            insar.export.export(input_, output, band=band, attr=attr,
+                                level=level, config=config,
+                                compress=compress, blocksize=blocksize)
     except Exception:
         logger.exception("Exception caught during processing")
         raise click.Abort()
 
 
 def save(arr, output, config):
+    import tiledb
+
     with tiledb.DenseArray(output, 'w') as dst:
         arr.to_tiledb(dst, storage_options=config)
 
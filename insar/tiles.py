@@ -0,0 +1,170 @@
+"""Overlapped tile I/O for TileDB SAR stacks."""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
+
+import numpy as np
+import tiledb
+
+
+class TileReader:
+    """Iterates over the tiles of a TileDB array reading ahead.
+
+    Reads are submitted to a thread pool so the next tiles are fetched
+    while the current one is processed, TileDB releases the GIL during
+    reads. Works standalone or inside a dask task.
+
+    Parameters
+    ----------
+    _input : string
+        Path to a TileDB stack or 2D array.
+    tiles : list
+        (y, x) tile indexes to read, defaults to all tiles.
+    bands : list
+        Band indexes to read from a stack, defaults to all bands.
+    attr : string
+        Attribute to read, defaults to the first attribute.
+    prefetch : int
+        Number of tiles to read ahead.
+    config : dict
+        TileDB configuration.
+    """
+
+    def __init__(self, _input, tiles=None, bands=None, attr=None,
+                 prefetch=2, config=None):
+        self._input = _input
+        self.bands = bands
+        self.prefetch = max(prefetch, 1)
+        self.config = config
+        self._local = threading.local()
+        self._opened = []
+
+        cfg = tiledb.Config(config)
+        self.ctx = tiledb.Ctx(config=cfg)
+        with tiledb.DenseArray(_input, 'r', ctx=self.ctx) as arr:
+            schema = arr.schema
+        self.ndim = schema.ndim
+        y_dim = schema.domain.dim(self.ndim - 2)
+        x_dim = schema.domain.dim(self.ndim - 1)
+        self.tile_y_size = int(y_dim.tile)
+        self.tile_x_size = int(x_dim.tile)
+        self.attr = attr if attr is not None else schema.attr(0).name
+
+        if tiles is None:
+            tiles = [(y, x) for y in range(y_dim.size // self.tile_y_size)
+                     for x in range(x_dim.size // self.tile_x_size)]
+        self.tiles = tiles
+
+    def window(self, y, x):
+        """Row and column slices of a tile."""
+        start_y = y * self.tile_y_size
+        start_x = x * self.tile_x_size
+        return (slice(start_y, start_y + self.tile_y_size),
+                slice(start_x, start_x + self.tile_x_size))
+
+    def read(self, y, x):
+        """Reads a single tile."""
+        # one open array per thread
+        arr = getattr(self._local, 'arr', None)
+        if arr is None:
+            arr = tiledb.DenseArray(self._input, 'r', ctx=self.ctx)
+            self._local.arr = arr
+            self._opened.append(arr)
+
+        query = arr.query(attrs=[self.attr])
+        ys, xs = self.window(y, x)
+        if self.ndim == 2:
+            return query[ys, xs][self.attr]
+        if self.bands is None:
+            return query[:, ys, xs][self.attr]
+        return np.stack([query[b, ys, xs][self.attr] for b in self.bands])
+
+    def close(self):
+        """Closes the arrays opened by the reading threads."""
+        for arr in self._opened:
+            arr.close()
+        self._opened = []
+        self._local = threading.local()
+
+    def __iter__(self):
+        pending = deque()
+        try:
+            with ThreadPoolExecutor(max_workers=self.prefetch) as pool:
+                try:
+                    for tile in self.tiles:
+                        pending.append((tile, pool.submit(self.read, *tile)))
+                        if len(pending) > self.prefetch:
+                            tile, future = pending.popleft()
+                            yield tile, future.result()
+
+                    while pending:
+                        tile, future = pending.popleft()
+                        yield tile, future.result()
+                finally:
+                    for _, future in pending:
+                        future.cancel()
+        finally:
+            self.close()
+
+
+class TileWriter:
+    """Writes tiles to a TileDB array from a background thread.
+
+    The queue is bounded, write blocks once queue_size tiles are waiting
+    so a fast producer cannot run ahead of the storage.
+
+    Parameters
+    ----------
+    output : string
+        Path to the TileDB output array.
+    queue_size : int
+        Maximum number of tiles waiting to be written.
+    config : dict
+        TileDB configuration.
+    """
+
+    def __init__(self, output, queue_size=2, config=None):
+        self.output = output
+        self.config = config
+        self._queue = queue.Queue(maxsize=max(queue_size, 1))
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        cfg = tiledb.Config(self.config)
+        ctx = tiledb.Ctx(config=cfg)
+        try:
+            with tiledb.DenseArray(self.output, 'w', ctx=ctx) as arr:
+                while True:
+                    item = self._queue.get()
+                    if item is None:
+                        break
+                    subarray, data = item
+                    arr[subarray] = data
+        except Exception as e:
+            self._error = e
+            # drain so that blocked producers are released
+            while self._queue.get() is not None:
+                pass
+
+    def write(self, subarray, data):
+        """Queues data for the subarray, a tuple of slices."""
+        if self._error is not None:
+            raise self._error
+        self._queue.put((subarray, data))
+
+    def close(self):
+        """Waits for the queued tiles to be written."""
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
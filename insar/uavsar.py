@@ -1,11 +1,12 @@
 """ Main routines for interferometric UAVSAR processing with TileDB."""
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import glob
+import json
 import logging
 import math
 import os
-
-import insar.sar as sar
+import time
 
 import xml.etree.ElementTree as ET
 
@@ -65,9 +66,33 @@ def read_ll_meta(file_name, rows, columns):
     return factors
 
 
-def stack(inputs, output, config=None,
-          tile_x_size=1024, tile_y_size=1024, bbox=None):
-    """Ingests a temporal stack of uavsar SLC images."""
+def find_geometry(file_name, ext):
+    """Finds the llh/lkv file of the flight line and segment of a SLC.
+
+    Returns None if the directory of the SLC has no such file.
+    """
+    data_path = os.path.dirname(os.path.abspath(file_name))
+    parts = os.path.basename(file_name)[:-4].split('_')
+    # e.g. site_line_stack_BC_s1_2x8.llh for site_line_..._BC_s1_1x1.slc
+    pattern = f"{parts[0]}_{parts[1]}_*_{parts[-2]}_*.{ext}"
+    found = sorted(glob.glob(os.path.join(data_path, pattern)))
+    return found[0] if len(found) > 0 else None
+
+
+def build_vrts(inputs):
+    """Builds the stack and geometry VRTs of SLC images.
+
+    GDAL opens a VRT from its XML, so no file is written and the VRTs can
+    be opened by remote workers that only see the SLC images.
+
+    Parameters
+    ----------
+    inputs : list
+        Paths to the SLC images of a stack.
+    Returns
+    -------
+    string, dict : XML of the stack VRT and of the geometry VRTs by layer.
+    """
     # find the first annotation file and read the dimensions
     prefix, segment_meta = read_ann(inputs[0])
     if 'rows' in segment_meta:
@@ -80,11 +105,10 @@ def stack(inputs, output, config=None,
     root.set('rasterXSize', str(cols))
     root.set('rasterYSize', str(rows))
 
-    data_path = os.path.dirname(os.path.abspath(inputs[0]))
+    lkv_file = find_geometry(inputs[0], 'lkv')
+    llh_file = find_geometry(inputs[0], 'llh')
 
-    if len(glob.glob(os.path.join(data_path, '*.lkv'))) > 0:
-        lkv_file = glob.glob(os.path.join(data_path, '*.lkv'))[0]
-        llh_file = glob.glob(os.path.join(data_path, '*.llh'))[0]
+    if lkv_file is not None and llh_file is not None:
         lkv_factors = read_ll_meta(lkv_file, rows, cols)
         llh_factors = read_ll_meta(llh_file, rows, cols)
     else:
@@ -97,10 +121,11 @@ def stack(inputs, output, config=None,
     data = {}
     for k, d in enumerate(inputs):
         _, meta = read_ann(d)
-        if 'stack_num' in meta:
-            data[meta['stack_num']] = d
-        else:
-            data[k] = d
+        idx = meta.get('stack_num', k)
+        if idx in data:
+            raise ValueError(f"{d} and {data[idx]} have the same stack "
+                             f"number {idx}, e.g. different polarizations")
+        data[idx] = d
 
     for idx in sorted(data):
         slc = data[idx]
@@ -112,7 +137,7 @@ def stack(inputs, output, config=None,
         metadata = ET.SubElement(band, 'Metadata')
         mdi = ET.SubElement(metadata, 'MDI')
         mdi.set('key', 'source')
-        mdi.text = os.path.splitext(slc)[0][2:]
+        mdi.text = os.path.basename(os.path.splitext(slc)[0])
         source_filename = ET.SubElement(band, 'SourceFilename')
         source_filename.set('relativeToVRT', '0')
         source_filename.text = slc
@@ -120,10 +145,7 @@ def stack(inputs, output, config=None,
         byte_order = ET.SubElement(band, 'ByteOrder')
         byte_order.text = 'LSB'
 
-    stack_vrt = os.path.join(data_path, 'stack.vrt')
-
-    with open(stack_vrt, 'wb') as f:
-        f.write(ET.tostring(root))
+    stack_vrt = ET.tostring(root, encoding='unicode')
 
     # create sidecar VRT files for lkv and llh
     attrs = {}
@@ -132,14 +154,15 @@ def stack(inputs, output, config=None,
             (lkv_file, lkv_factors, ('east', 'north', 'up')),
             (llh_file, llh_factors, ('lat', 'lon', 'height'))
         ]:
-            root = ET.Element('VRTDataset')
             meta_cols = math.ceil(cols / factors[1])
             meta_rows = math.ceil(rows / factors[0])
-            root.set('rasterXSize', str(meta_cols))
-            root.set('rasterYSize', str(meta_rows))
 
             i = 1
             for b in bands:
+                # one single band VRT per geometry layer
+                root = ET.Element('VRTDataset')
+                root.set('rasterXSize', str(meta_cols))
+                root.set('rasterYSize', str(meta_rows))
                 band = ET.SubElement(root, 'VRTRasterBand')
                 band.set('dataType', 'Float32')
                 band.set('band', str(1))
@@ -152,18 +175,144 @@ def stack(inputs, output, config=None,
                 pixel_offset = ET.SubElement(band, 'PixelOffset')
                 pixel_offset.text = str(12)
                 line_offset = ET.SubElement(band, 'LineOffset')
-                line_offset.text = str(meta_cols * 3)
+                line_offset.text = str(meta_cols * 12)
                 i = i + 1
 
-                output_vrt = os.path.join(data_path, b + '.vrt')
-                with open(output_vrt, 'wb') as f:
-                    f.write(ET.tostring(root))
-                    attrs[b] = output_vrt
+                attrs[b] = ET.tostring(root, encoding='unicode')
+
+    return stack_vrt, attrs
+
 
+def stack(inputs, output, config=None,
+          tile_x_size=1024, tile_y_size=1024, bbox=None):
+    """Ingests a temporal stack of uavsar SLC images."""
+    import insar.sar as sar
+
+    stack_vrt, attrs = build_vrts(inputs)
     sar.stack(stack_vrt, output, tile_x_size, tile_y_size,
               config, attrs=attrs, bbox=bbox)
 
 
+def find_slc(inputs):
+    """Lists SLC images from directory trees, manifests or file paths.
+
+    A manifest is a text file with one SLC path per line.
+    """
+    slcs = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for dirpath, _, files in os.walk(path):
+                slcs.extend(os.path.join(dirpath, f)
+                            for f in sorted(files) if f.endswith('.slc'))
+        elif path.endswith('.slc'):
+            slcs.append(path)
+        else:
+            with open(path) as manifest:
+                for line in manifest.readlines():
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        slcs.append(line)
+    return slcs
+
+
+def group_slc(slcs):
+    """Groups SLC images by site, flight line, polarization, stack version
+    and segment.
+
+    Returns
+    -------
+    dict, dict : SLC paths by group name and errors by unreadable path.
+    """
+    groups = {}
+    errors = {}
+    for slc in slcs:
+        try:
+            prefix, _ = read_ann(slc)
+        except Exception as e:
+            errors[slc] = repr(e)
+            continue
+        parts = os.path.basename(slc).split('_')
+        _, segment, down_sample = prefix.split('_')
+        # e.g. site_line_..._L090HH_02_BC_s1_1x1.slc, one stack per
+        # polarization as the polarizations share stack numbers
+        name = f"{parts[0]}_{parts[1]}_{parts[-5]}_{parts[-4]}_" \
+            f"s{segment}_{down_sample}"
+        groups.setdefault(name, []).append(slc)
+    return groups, errors
+
+
+def batch_stack(inputs, output, config=None, tile_x_size=1024,
+                tile_y_size=1024, bbox=None, max_concurrent=4):
+    """Ingests many flight lines and segments into a TileDB group.
+
+    Each site, flight line and segment is ingested into its own array in
+    the group, groups are ingested concurrently and their chunks computed
+    on the shared Dask cluster if one is set up.
+
+    Parameters
+    ----------
+    inputs : list
+        Directory trees, manifest files or paths of SLC images.
+    output : string
+        Path to the output TileDB group.
+    max_concurrent : int
+        Number of stacks ingested at the same time.
+    Returns
+    -------
+    dict : summary of the ingested arrays, failures and throughput.
+    """
+    import tiledb
+
+    start = time.time()
+    groups, failed = group_slc(find_slc(inputs))
+
+    cfg = tiledb.Config(config)
+    ctx = tiledb.Ctx(config=cfg)
+    tiledb.Group.create(output, ctx=ctx)
+
+    def ingest(name):
+        stack(groups[name], f"{output}/{name}", config,
+              tile_x_size, tile_y_size, bbox)
+        return sum(os.path.getsize(slc) for slc in groups[name])
+
+    arrays = []
+    n_bytes = 0
+    with ThreadPoolExecutor(max_workers=max_concurrent) as pool:
+        futures = {pool.submit(ingest, name): name for name in groups}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                n_bytes = n_bytes + future.result()
+                arrays.append(name)
+            except Exception as e:
+                logger.exception(f"Unable to ingest {name}.")
+                failed[name] = repr(e)
+
+    with tiledb.Group(output, 'w', ctx=ctx) as group:
+        for name in sorted(arrays):
+            group.add(name, name=name, relative=True)
+
+            # the geometry layers are arrays next to the stack
+            with tiledb.open(f"{output}/{name}", 'r', ctx=ctx) as arr:
+                geometry = json.loads(arr.meta.get('geometry', '{}'))
+            for layer in sorted(geometry):
+                group.add(f"{name}_{layer}", name=f"{name}_{layer}",
+                          relative=True)
+
+    seconds = time.time() - start
+    summary = {
+        'output': output,
+        'arrays': sorted(arrays),
+        'failed': failed,
+        'bytes': n_bytes,
+        'seconds': seconds,
+        'mb_per_second': n_bytes / 1e6 / seconds if seconds > 0 else 0.,
+    }
+    logger.info(f"Ingested {len(arrays)} stacks ({n_bytes / 1e6:.1f} MB) "
+                f"in {seconds:.1f}s, {len(failed)} failed.")
+    return summary
+
+
 def num(s):
     try:
         return int(s)
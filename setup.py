@@ -49,6 +49,8 @@ setup(
       [rasterio.rio_plugins]
       stack-sar=insar.scripts.cli:stack_sar
       process-stack=insar.scripts.cli:process_stack
+      batch-stack=insar.scripts.cli:batch_stack
+      export-sar=insar.scripts.cli:export_sar
       flight-path=insar.scripts.flight:flight_path
       """,
 )
@@ -0,0 +1,124 @@
+"""Tests the co-registration of stack bands."""
+
+import json
+import os
+
+import numpy as np
+import pytest
+import tiledb
+
+from insar import coregistration, sar
+
+size, tile_size = 64, 32
+
+
+@pytest.fixture(scope='module', autouse=True)
+def client():
+    sar.setup(n_workers=1, threads_per_worker=2)
+    yield sar.client
+    sar.client.close()
+
+
+@pytest.fixture
+def shifted_stack(tmpdir):
+    np.random.seed(0)
+    output = os.path.join(tmpdir, 'stack')
+    dom = tiledb.Domain(
+            tiledb.Dim(name='BANDS', domain=(0, 1), tile=1),
+            tiledb.Dim(name='Y', domain=(0, size - 1),
+                       tile=tile_size, dtype=np.uint64),
+            tiledb.Dim(name='X', domain=(0, size - 1),
+                       tile=tile_size, dtype=np.uint64))
+    schema = tiledb.ArraySchema(domain=dom, sparse=False,
+                                attrs=[tiledb.Attr(name="TDB_VALUES",
+                                       dtype=np.complex64)])
+    tiledb.DenseArray.create(output, schema)
+
+    reference = np.random.rayleigh(1., (size, size)) + 0.j
+    # ref(p) = sec(p + (2, -3))
+    secondary = np.roll(reference, (2, -3), axis=(0, 1))
+    with tiledb.DenseArray(output, 'w') as arr:
+        arr[:] = np.stack([reference, secondary]).astype(np.complex64)
+    return output, reference
+
+
+def test_chip_offsets():
+    np.random.seed(1)
+    chips = np.random.rand(3, 32, 32)
+    shifted = np.stack([np.roll(c, s, axis=(0, 1))
+                        for c, s in zip(chips, [(0, 0), (4, 1), (-2, -5)])])
+    dy, dx, peak = coregistration.chip_offsets(chips, shifted)
+    np.testing.assert_allclose(dy, [0, 4, -2], atol=1e-6)
+    np.testing.assert_allclose(dx, [0, 1, -5], atol=1e-6)
+    assert np.all(peak > 0.9)
+
+
+def test_fit_warp():
+    y, x = np.mgrid[0:100:10, 0:100:10].reshape(2, -1).astype(float)
+    offsets = np.column_stack([y, x, 0.5 + 0.01 * x, -1 + 0.02 * y,
+                               np.ones_like(y)])
+    warp = coregistration.fit_warp(offsets, order=1)
+    np.testing.assert_allclose(warp['dy'], [0.5, 0, 0.01], atol=1e-9)
+    np.testing.assert_allclose(warp['dx'], [-1, 0.02, 0], atol=1e-9)
+
+
+def test_sinc_interpolate():
+    np.random.seed(2)
+    n = 64
+    # band limited complex data, like an oversampled SLC
+    spectrum = np.fft.fft2(np.random.normal(size=(n, n)) +
+                           1.j * np.random.normal(size=(n, n)))
+    ky = np.fft.fftfreq(n)[:, None]
+    kx = np.fft.fftfreq(n)[None, :]
+    spectrum[(np.abs(ky) > 0.4) | (np.abs(kx) > 0.4)] = 0
+    reference = np.fft.ifft2(spectrum)
+
+    # ref(p) = sec(p + d) for a sub-pixel d
+    d = (0.3, -0.45)
+    secondary = np.fft.ifft2(spectrum * np.exp(
+        -2.j * np.pi * (ky * d[0] + kx * d[1])))
+
+    yy, xx = np.mgrid[0:n, 0:n].astype(np.float64)
+    result = coregistration.sinc_interpolate(secondary, yy + d[0], xx + d[1])
+
+    # the phase is kept so the coherence with the reference is preserved
+    a = reference[8:-8, 8:-8]
+    b = result[8:-8, 8:-8]
+    coherence = np.abs(np.sum(a * np.conjugate(b))) / np.sqrt(
+        np.sum(np.abs(a) ** 2) * np.sum(np.abs(b) ** 2))
+    assert coherence > 0.99
+
+
+def test_coregister(shifted_stack, tmpdir):
+    _input, reference = shifted_stack
+    output = os.path.join(tmpdir, 'coregistered')
+    registration = coregistration.coregister(_input, output, chip_size=16,
+                                             order=0)
+    np.testing.assert_allclose(registration['warps']['1']['dy'], [2],
+                               atol=0.05)
+    np.testing.assert_allclose(registration['warps']['1']['dx'], [-3],
+                               atol=0.05)
+
+    with tiledb.DenseArray(output, 'r') as arr:
+        result = arr[:]['TDB_VALUES']
+    np.testing.assert_allclose(np.abs(result[1, :-2, 3:]),
+                               np.abs(reference[:-2, 3:]), atol=0.1)
+
+    # all bands of a tile are written at once
+    assert len(tiledb.FragmentInfoList(output)) == (size // tile_size) ** 2
+
+    # estimation is skipped on a rerun with the same parameters
+    with tiledb.DenseArray(_input, 'w') as arr:
+        cached = dict(registration)
+        cached['warps'] = {'1': {'dy': [0.], 'dx': [0.]}}
+        arr.meta['coregistration'] = json.dumps(cached)
+    rerun = coregistration.coregister(_input, output + '_rerun',
+                                      chip_size=16, order=0)
+    assert rerun['warps']['1']['dy'] == [0.]
+
+    # but not once the input is modified
+    with tiledb.DenseArray(_input, 'w') as arr:
+        arr[0, 0:1, 0:1] = np.zeros((1, 1), dtype=np.complex64)
+    rerun = coregistration.coregister(_input, output + '_modified',
+                                      chip_size=16, order=0)
+    np.testing.assert_allclose(rerun['warps']['1']['dy'], [2], atol=0.05)
@@ -0,0 +1,49 @@
+"""Tests the export of TileDB arrays to COGs."""
+
+import os
+
+import numpy as np
+import pytest
+import rasterio
+import tiledb
+
+from insar import export, sar
+
+
+def test_export(tmpdir):
+    np.random.seed(0)
+    _input = os.path.join(tmpdir, 'ccd')
+    dom = tiledb.Domain(
+            tiledb.Dim(domain=(0, 39), tile=20, dtype=np.uint64),
+            tiledb.Dim(domain=(0, 59), tile=20, dtype=np.uint64))
+    schema = tiledb.ArraySchema(domain=dom, sparse=False,
+                                attrs=[tiledb.Attr(name="c",
+                                       dtype=np.float32)])
+    tiledb.DenseArray.create(_input, schema)
+    data = np.random.rand(40, 60).astype(np.float32)
+    with tiledb.DenseArray(_input, 'w') as arr:
+        arr[:] = data
+
+    # the image is smaller than the tile padded domain
+    trans = (500000., 10., 0., 4000000., 0., -10.)
+    crs = rasterio.crs.CRS.from_epsg(32611).to_wkt()
+    sar.write_aux_xml(_input, trans, np.float32, 32, 50, 35, crs=crs)
+
+    output = os.path.join(tmpdir, 'ccd.tif')
+    assert export.export(_input, output, blocksize=16, prefetch=2) == output
+
+    with rasterio.open(output) as src:
+        assert src.profile['tiled']
+        assert src.profile['compress'] == 'deflate'
+        assert (src.width, src.height) == (50, 35)
+        assert src.transform.to_gdal() == trans
+        assert src.crs.to_epsg() == 32611
+        assert src.overviews(1) == [2, 4]
+        np.testing.assert_array_equal(src.read(1), data[:35, :50])
+
+    # the intermediate next to the output is removed
+    assert sorted(os.listdir(tmpdir)) == ['ccd', 'ccd.tif']
+
+    # only registered overview levels are exported
+    with pytest.raises(ValueError):
+        export.export(_input, os.path.join(tmpdir, 'ovr.tif'), level=2)
@@ -0,0 +1,42 @@
+"""Guards the import time of the package and the rio plugins."""
+
+import subprocess
+import sys
+
+import pytest
+
+heavy = ('dask', 'dask_image', 'distributed', 'rasterio', 'tiledb', 'xarray')
+
+# generous for a cold start, loading any of the heavy modules takes seconds
+budget = 0.5
+
+
+def import_times(module):
+    """Cumulative import time in seconds of each module imported."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+@pytest.mark.parametrize('module', [
+    'insar', 'insar.scripts.cli', 'insar.scripts.flight'])
+def test_import_time(module):
+    times = import_times(module)
+    assert not [m for m in heavy if m in times]
+    assert times[module] < budget
+
+
+def test_lazy_attributes():
+    code = ("import sys, insar; insar.read_ann; insar.ccd; "
+            "print('tiledb' in sys.modules)")
+    result = subprocess.run([sys.executable, '-c', code],
+                            stdout=subprocess.PIPE, universal_newlines=True,
+                            check=True)
+    assert result.stdout.strip() == 'True'
@@ -0,0 +1,261 @@
+"""Tests the generic SAR algorithms."""
+
+import os
+
+from click.testing import CliRunner
+import numpy as np
+import pytest
+import rasterio
+import tiledb
+
+import insar
+from insar import sar
+from insar.cache import ProductCache
+from insar.scripts.cli import process_stack
+from insar.tiles import TileReader, TileWriter
+
+n_bands, height, width = 5, 16, 16
+tile_size = 8
+
+
+@pytest.fixture(scope='module', autouse=True)
+def client():
+    sar.setup(n_workers=1, threads_per_worker=2)
+    yield sar.client
+    sar.client.close()
+
+
+@pytest.fixture
+def stack_array(tmpdir):
+    np.random.seed(0)
+    output = os.path.join(tmpdir, 'stack')
+    dom = tiledb.Domain(
+            tiledb.Dim(name='BANDS', domain=(0, n_bands - 1), tile=1),
+            tiledb.Dim(name='Y', domain=(0, height - 1),
+                       tile=tile_size, dtype=np.uint64),
+            tiledb.Dim(name='X', domain=(0, width - 1),
+                       tile=tile_size, dtype=np.uint64))
+    schema = tiledb.ArraySchema(domain=dom, sparse=False,
+                                attrs=[tiledb.Attr(name="TDB_VALUES",
+                                       dtype=np.complex64)])
+    tiledb.DenseArray.create(output, schema)
+
+    # a stable scatterer in the top left, noise elsewhere
+    data = np.random.rayleigh(1., (n_bands, height, width)) * \
+        np.exp(1.j * np.random.uniform(-np.pi, np.pi, (n_bands, height, width)))
+    data[:, 2, 3] = 10. + 0.j
+    with tiledb.DenseArray(output, 'w') as arr:
+        arr[:] = data.astype(np.complex64)
+    return output, data
+
+
+def test_statistics(stack_array, tmpdir):
+    _input, data = stack_array
+    output = os.path.join(tmpdir, 'stats')
+    stats, ps = sar.statistics(_input, output, threshold=0.05)
+    assert stats == output
+    assert ps == output + '_ps'
+
+    amplitude = np.abs(data)
+    with tiledb.DenseArray(stats, 'r') as arr:
+        result = arr[:]
+    np.testing.assert_allclose(result['mean'], amplitude.mean(axis=0),
+                               rtol=1e-5)
+    np.testing.assert_allclose(
+        result['dispersion'],
+        amplitude.std(axis=0, ddof=1) / amplitude.mean(axis=0), rtol=1e-4)
+    assert np.all(result['coh_min'] <= result['coh_max'])
+
+    with tiledb.SparseArray(ps, 'r') as arr:
+        candidates = arr[:]
+    assert list(candidates['Y']) == [2]
+    assert list(candidates['X']) == [3]
+    np.testing.assert_allclose(candidates['mean'], [10.])
+
+
+def test_statistics_bands(stack_array):
+    _input, _ = stack_array
+    with pytest.raises(IndexError):
+        sar.statistics(_input, bands=[0])
+
+
+def test_overviews(stack_array):
+    _input, data = stack_array
+    # an image smaller than the tile padded domain
+    sar.write_aux_xml(_input, (0., 1., 0., 0., 0., -1.), np.complex64, 64,
+                      13, 11)
+    outputs = sar.overviews(_input, levels=2)
+    assert outputs == [sar.overview_uri(_input, 2),
+                       sar.overview_uri(_input, 4)]
+    assert sar.overview_factors(_input) == [2, 4]
+
+    # one fragment per tile holding all bands
+    for output in outputs:
+        assert len(tiledb.FragmentInfoList(output)) == 4
+
+    aux = sar.read_aux_xml(outputs[1])
+    assert (aux['width'], aux['height']) == (4, 3)
+    assert aux['transform'] == (0., 4., 0., 0., 0., -4.)
+
+    amplitude = np.abs(data.astype(np.complex64))
+    with tiledb.DenseArray(outputs[1], 'r') as arr:
+        level = arr[:]['TDB_VALUES']
+    assert level.shape == (n_bands, height // 4, width // 4)
+    np.testing.assert_allclose(
+        level[:, 1, 2],
+        amplitude[:, 4:8, 8:12].mean(axis=(1, 2)), rtol=1e-5)
+
+    assert sar.select_overview(_input, width, height) == (_input, 1)
+    assert sar.select_overview(_input, 6, 6) == (outputs[0], 2)
+    assert sar.select_overview(_input, 1, 1) == (outputs[1], 4)
+
+    # readers open the levels by factor or by the size needed
+    ds = insar.open_stack(_input, level=4)
+    assert ds.TDB_VALUES.shape == (n_bands, height // 4, width // 4)
+    np.testing.assert_array_equal(ds.TDB_VALUES.values, level)
+    assert insar.open_stack(_input, size=(6, 6)).attrs['factor'] == 2
+    with pytest.raises(ValueError):
+        insar.open_stack(_input, level=8)
+
+
+def test_overviews_tile_size(stack_array):
+    _input, _ = stack_array
+    with pytest.raises(ValueError):
+        sar.overviews(_input, levels=4)
+
+
+def test_tile_reader(stack_array):
+    _input, data = stack_array
+    reader = TileReader(_input, bands=[3, 1], prefetch=3)
+    tiles = list(reader)
+    assert [t for t, _ in tiles] == [(0, 0), (0, 1), (1, 0), (1, 1)]
+    for (y, x), tile in tiles:
+        ys, xs = reader.window(y, x)
+        np.testing.assert_array_equal(
+            tile, data[[3, 1], ys, xs].astype(np.complex64))
+
+
+def test_tile_writer(stack_array, tmpdir):
+    _input, data = stack_array
+    output = os.path.join(tmpdir, 'copy')
+    with tiledb.DenseArray(_input, 'r') as arr:
+        tiledb.DenseArray.create(output, arr.schema)
+
+    reader = TileReader(_input, prefetch=1)
+    with TileWriter(output, queue_size=1) as writer:
+        for (y, x), tile in reader:
+            writer.write((slice(None),) + reader.window(y, x), tile)
+
+    with tiledb.DenseArray(output, 'r') as arr:
+        np.testing.assert_array_equal(arr[:]['TDB_VALUES'],
+                                      data.astype(np.complex64))
+
+
+def test_ccd(stack_array, tmpdir):
+    _input, data = stack_array
+    output = sar.ccd(_input, (0, 0), os.path.join(tmpdir, 'ccd'))
+    with tiledb.DenseArray(output, 'r') as arr:
+        np.testing.assert_allclose(arr[:]['c'], 1.)
+
+
+def test_ccd_cache(stack_array, tmpdir):
+    _input, _ = stack_array
+    cache = ProductCache(os.path.join(tmpdir, 'cache'), max_entries=2)
+    trans = (500000., 10., 0., 4000000., 0., -10.)
+    sar.write_aux_xml(_input, trans, np.complex64, 64, 13, 11)
+
+    output = sar.ccd(_input, (0, 1), cache=cache)
+    aux = sar.read_aux_xml(output)
+    assert aux['transform'] == trans
+    assert (aux['width'], aux['height']) == (13, 11)
+    assert output == cache.path(cache.provenance(
+        _input, 'ccd', bands=[0, 1], neighbourhood=7))
+    with tiledb.DenseArray(output, 'r') as arr:
+        assert arr.meta['provenance_key'] == os.path.basename(output)[4:]
+
+    # a repeated request returns the cached product without writing to it
+    meta = os.listdir(os.path.join(output, '__meta'))
+    assert sar.ccd(_input, (0, 1), cache=cache) == output
+    assert os.listdir(os.path.join(output, '__meta')) == meta
+
+    # other parameters and a modified input are new products
+    assert sar.ccd(_input, (0, 2), cache=cache) != output
+    with tiledb.DenseArray(_input, 'w') as arr:
+        arr[0, 0:1, 0:1] = np.zeros((1, 1), dtype=np.complex64)
+    modified = sar.ccd(_input, (0, 1), cache=cache)
+    assert modified != output
+
+    # the least recently used product is evicted
+    entries = [os.path.basename(e[0].rstrip('/')) for e in cache.entries()]
+    assert len(entries) == 2
+    assert os.path.basename(output) not in entries
+    assert os.path.basename(modified) in entries
+
+
+def test_cache_incomplete(stack_array, tmpdir):
+    _input, _ = stack_array
+    cache = ProductCache(os.path.join(tmpdir, 'cache'), staging_timeout=60)
+    provenance = cache.provenance(_input, 'ccd', bands=[0, 1],
+                                  neighbourhood=7)
+
+    # a product another run is still writing is neither used nor removed
+    schema = tiledb.ArraySchema.load(_input)
+    staging = cache.staging_path(provenance)
+    tiledb.DenseArray.create(staging, schema)
+    tiledb.DenseArray.create(cache.path(provenance), schema)
+    assert cache.get(provenance) is None
+    assert tiledb.object_type(cache.path(provenance)) == 'array'
+    cache.entries()
+    assert tiledb.object_type(staging) == 'array'
+
+    # abandoned staging arrays are removed after the timeout
+    cache.staging_timeout = -1
+    cache.entries()
+    assert tiledb.object_type(staging) is None
+
+
+def test_process_statistics(stack_array, tmpdir):
+    _input, data = stack_array
+    amplitude = np.abs(data.astype(np.complex64))
+
+    output = os.path.join(tmpdir, 'stats')
+    insar.process(_input, 'ps', output=output)
+    with tiledb.DenseArray(output, 'r') as arr:
+        np.testing.assert_allclose(arr[:]['mean'], amplitude.mean(axis=0),
+                                   rtol=1e-5)
+
+    # both the statistics and the PS candidates are cached
+    cache = ProductCache(os.path.join(tmpdir, 'cache'))
+    cached = insar.process(_input, 'ps', cache=cache)
+    assert all(os.path.dirname(uri) == cache.root for uri in cached)
+    with tiledb.DenseArray(cached[0], 'r') as arr:
+        np.testing.assert_allclose(arr[:]['mean'], amplitude.mean(axis=0),
+                                   rtol=1e-5)
+    assert insar.process(_input, 'ps', cache=cache) == cached
+
+
+def test_process_stack_cli(stack_array, tmpdir, monkeypatch):
+    _input, data = stack_array
+    amplitude = np.abs(data.astype(np.complex64))
+    # reuse the client of the module
+    monkeypatch.setattr(sar, 'setup', lambda *args: None)
+
+    output = os.path.join(tmpdir, 'stats')
+    result = CliRunner().invoke(
+        process_stack, [_input, '--output', output, '-f', 'ps',
+                        '--ps_bands', '0,2,4'],
+        obj={'env': rasterio.Env()})
+    assert result.exit_code == 0
+    with tiledb.DenseArray(output, 'r') as arr:
+        np.testing.assert_allclose(arr[:]['mean'],
+                                   amplitude[[0, 2, 4]].mean(axis=0),
+                                   rtol=1e-5)
+
+    # the band pair form of existing invocations
+    output = os.path.join(tmpdir, 'ccd')
+    result = CliRunner().invoke(
+        process_stack, [_input, '--output', output, '-f', 'ccd',
+                        '--bands', '0', '1'],
+        obj={'env': rasterio.Env()})
+    assert result.exit_code == 0
+    assert os.path.exists(output)
@@ -3,12 +3,14 @@
 import glob
 import math
 import os
+import shutil
 
 import dask.array as da
 import numpy as np
 import pytest
+import tiledb
 
-from insar import uavsar
+from insar import open_stack, uavsar
 from insar.sar import local_ccd
 
 mu, sigma = 0.5, 0.24
@@ -63,11 +65,114 @@ def test_read_lkv(data_dir):
     assert factor == (2, 2)
 
 
+def test_find_geometry(data_dir, tmpdir):
+    slc = os.path.join(data_dir,
+                       'Test_XXXXX_XXXXX_001_XXXXXX_XXXHH_02_BC_s1_1x1.slc')
+    assert uavsar.find_geometry(slc, 'llh') == os.path.join(
+        data_dir, 'Test_XXXXX_02_BC_s1_2x2.llh')
+
+    # the geometry of another segment is not used
+    assert uavsar.find_geometry(slc.replace('_s1_', '_s2_'), 'llh') is None
+
+
 def test_stack(data_dir, tmpdir):
     output = os.path.join(tmpdir, 'test_array')
     inputs = glob.glob(os.path.join(data_dir, '*.slc'))
     uavsar.stack(inputs, output, tile_x_size=3, tile_y_size=7)
     assert os.path.exists(output)
+    assert glob.glob(os.path.join(data_dir, '*.vrt')) == []
+
+
+def test_open_stack(data_dir, tmpdir):
+    output = os.path.join(tmpdir, 'test_array')
+    inputs = glob.glob(os.path.join(data_dir, '*.slc'))
+    uavsar.stack(inputs, output, tile_x_size=3, tile_y_size=7)
+
+    ds = open_stack(output)
+    assert list(ds.band.values) == [
+        'Test_XXXXX_XXXXX_001_XXXXXX_XXXHH_02_BC_s1_1x1',
+        'Test_XXXXX_XXXXX_002_XXXXXX_XXXHH_02_BC_s1_1x1']
+    assert ds.TDB_VALUES.data.chunksize == (1, 7, 3)
+    assert ds.lat.shape == (21, 12)
+
+    # geometry is down sampled 2x2 in the test data
+    lat = ds.lat.values
+    np.testing.assert_array_equal(lat[0:2, 0:2], lat[0, 0])
+
+    subset = ds.isel(band=1, y=slice(2, 5), x=slice(1, 3))
+    loaded = subset.sar.load()
+    assert loaded.TDB_VALUES.dims == ('y', 'x')
+    np.testing.assert_array_equal(loaded.TDB_VALUES.values,
+                                  subset.TDB_VALUES.values)
+
+
+def test_open_moved_stack(data_dir, tmpdir):
+    inputs = glob.glob(os.path.join(data_dir, '*.slc'))
+    uavsar.stack(inputs, os.path.join(tmpdir, 'test_array'),
+                 tile_x_size=3, tile_y_size=7)
+
+    # the geometry is stored relative to the stack and moves with it
+    moved = os.path.join(tmpdir, 'moved')
+    os.mkdir(moved)
+    for name in os.listdir(tmpdir):
+        if name.startswith('test_array'):
+            shutil.move(os.path.join(tmpdir, name), os.path.join(moved, name))
+    ds = open_stack(os.path.join(moved, 'test_array'))
+    assert ds.lat.shape == (21, 12)
+
+
+def test_group_slc(data_dir):
+    slcs = uavsar.find_slc([data_dir])
+    assert len(slcs) == 2
+
+    groups, errors = uavsar.group_slc(slcs + ['/foo/Test_XXXXX_s1_1x1.slc'])
+    assert sorted(groups['Test_XXXXX_XXXHH_02_s1_1x1']) == sorted(slcs)
+    assert list(errors) == ['/foo/Test_XXXXX_s1_1x1.slc']
+
+
+def test_group_polarizations(data_dir, tmpdir):
+    # an HV copy of the HH acquisitions with the same stack numbers
+    for path in glob.glob(os.path.join(data_dir, 'Test_*')):
+        name = os.path.basename(path)
+        shutil.copy(path, os.path.join(tmpdir, name))
+        if 'XXXHH' in name:
+            shutil.copy(path, os.path.join(tmpdir,
+                                           name.replace('XXXHH', 'XXXHV')))
+
+    slcs = uavsar.find_slc([str(tmpdir)])
+    groups, errors = uavsar.group_slc(slcs)
+    assert errors == {}
+    assert sorted(groups) == ['Test_XXXXX_XXXHH_02_s1_1x1',
+                              'Test_XXXXX_XXXHV_02_s1_1x1']
+    assert all(len(group) == 2 for group in groups.values())
+
+    # mixed polarizations are not silently dropped
+    with pytest.raises(ValueError):
+        uavsar.build_vrts(slcs)
+
+
+def test_batch_stack(data_dir, tmpdir):
+    output = os.path.join(tmpdir, 'group')
+    manifest = os.path.join(tmpdir, 'manifest.txt')
+    with open(manifest, 'w') as f:
+        f.write('/foo/Test_XXXXX_XXXXX_001_XXXXXX_XXXHH_02_BC_s1_1x1.slc\n')
+
+    summary = uavsar.batch_stack([data_dir, manifest], output,
+                                 tile_x_size=3, tile_y_size=7)
+    assert summary['arrays'] == ['Test_XXXXX_XXXHH_02_s1_1x1']
+    assert list(summary['failed']) == [
+        '/foo/Test_XXXXX_XXXXX_001_XXXXXX_XXXHH_02_BC_s1_1x1.slc']
+    assert summary['bytes'] == 4000
+
+    # the stack and its geometry layers are members of the group
+    with tiledb.Group(output) as group:
+        members = sorted(os.path.basename(m.uri) for m in group)
+    assert members == ['Test_XXXXX_XXXHH_02_s1_1x1'] + [
+        f'Test_XXXXX_XXXHH_02_s1_1x1_{layer}'
+        for layer in sorted(['east', 'north', 'up', 'lat', 'lon', 'height'])]
+    stack = os.path.join(output, 'Test_XXXXX_XXXHH_02_s1_1x1')
+    assert open_stack(stack).band.size == 2
+    assert glob.glob(os.path.join(data_dir, '*.vrt')) == []
 
 
 def test_no_ccd():